@@ -0,0 +1,149 @@
+import os
+import time
+import logging
+import threading
+
+# Per-upstream circuit breakers plus a per-request deadline. Breaker state is module
+# level, so it persists for the life of the warm container: once an upstream has
+# failed FAILURE_THRESHOLD times in a row, calls fail fast until RESET_TIMEOUT has
+# passed, then a single probe is let through to decide whether to close again.
+FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", "5"))
+RESET_TIMEOUT = float(os.environ.get("BREAKER_RESET_SECONDS", "30"))
+DEADLINE_RESERVE_MS = 1500  # time kept back to build and return the response
+DEADLINE_SLACK = 0.1  # seconds; a capped call failing this close to the deadline hit our cap, not the upstream
+# A call cut short by the deadline still counts as an upstream failure if it was given
+# at least this long: an upstream that cannot answer in that time is hanging.
+MIN_FAULT_TIMEOUT = float(os.environ.get("BREAKER_MIN_TIMEOUT_SECONDS", "5"))
+TIMEOUT_RETRY_AFTER = 5  # seconds clients are asked to wait after an upstream timed out
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+_breakers = {}
+_lock = threading.Lock()
+_deadline = None
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose breaker is open."""
+
+    def __init__(self, upstream, retry_after):
+        super().__init__(f"Circuit open for {upstream}, retry after {retry_after:.0f}s")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    """Raised when there is no time left in the invocation for another downstream call."""
+
+
+def start_request(context, reserve_ms=DEADLINE_RESERVE_MS):
+    """Set the deadline for this invocation from the Lambda context's remaining time."""
+    global _deadline
+    if context is None or not hasattr(context, "get_remaining_time_in_millis"):
+        _deadline = None
+        return
+    _deadline = time.monotonic() + (context.get_remaining_time_in_millis() - reserve_ms) / 1000.0
+
+
+def remaining():
+    """Seconds left before the deadline, or None when no deadline is set."""
+    if _deadline is None:
+        return None
+    return _deadline - time.monotonic()
+
+
+def cap_timeout(timeout):
+    """Cap a downstream timeout to the time left, raising if the deadline has passed."""
+    left = remaining()
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return min(timeout, left)
+
+
+def _breaker(upstream):
+    return _breakers.setdefault(upstream, {"state": CLOSED, "failures": 0, "openedAt": 0.0, "probing": False})
+
+
+def _before_call(upstream):
+    with _lock:
+        breaker = _breaker(upstream)
+        if breaker["state"] == CLOSED:
+            return
+        elapsed = time.monotonic() - breaker["openedAt"]
+        if breaker["state"] == OPEN and elapsed >= RESET_TIMEOUT:
+            breaker["state"] = HALF_OPEN
+            breaker["probing"] = False
+        if breaker["state"] == HALF_OPEN and not breaker["probing"]:
+            breaker["probing"] = True
+            logger.info(f"Circuit for {upstream} half-open, sending probe")
+            return
+        raise CircuitOpenError(upstream, max(0.0, RESET_TIMEOUT - elapsed))
+
+
+def _record_success(upstream):
+    with _lock:
+        breaker = _breaker(upstream)
+        if breaker["state"] != CLOSED:
+            logger.info(f"Circuit for {upstream} closed")
+        breaker.update(state=CLOSED, failures=0, probing=False)
+
+
+def _record_failure(upstream):
+    with _lock:
+        breaker = _breaker(upstream)
+        breaker["failures"] += 1
+        if breaker["state"] == HALF_OPEN or breaker["failures"] >= FAILURE_THRESHOLD:
+            if breaker["state"] != OPEN:
+                logger.warning(f"Circuit for {upstream} opened after {breaker['failures']} failures")
+            breaker.update(state=OPEN, openedAt=time.monotonic(), probing=False)
+
+
+def _record_neutral(upstream):
+    """The call said nothing about upstream health; free the half-open probe slot."""
+    with _lock:
+        _breaker(upstream)["probing"] = False
+
+
+def _is_upstream_fault(error):
+    """Client errors (4xx other than 429) and our own deadline say nothing about upstream health."""
+    if isinstance(error, DeadlineExceeded):
+        return False
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    return not (status and 400 <= status < 500 and status != 429)
+
+
+def call(upstream, fn, *args, timeout=None, cancelled=None, **kwargs):
+    """
+    Run `fn` through the breaker for `upstream`, recording its outcome. `timeout` is
+    capped by the request deadline before the breaker is consulted and passed on to
+    `fn`, so a spent deadline raises DeadlineExceeded without touching the breaker.
+    Failures after the caller set `cancelled` (e.g. by closing the connection), or
+    once a deadline-shortened timeout under MIN_FAULT_TIMEOUT has run out, are not
+    counted against `upstream`.
+    """
+    shortened = False
+    if timeout is not None:
+        kwargs["timeout"] = cap_timeout(timeout)
+        shortened = kwargs["timeout"] < min(timeout, MIN_FAULT_TIMEOUT)
+    _before_call(upstream)
+    try:
+        result = fn(*args, **kwargs)
+    except Exception as e:
+        if cancelled is not None and cancelled.is_set():
+            _record_neutral(upstream)
+        elif shortened and remaining() <= DEADLINE_SLACK:
+            _record_neutral(upstream)
+        elif _is_upstream_fault(e):
+            _record_failure(upstream)
+        else:
+            _record_success(upstream)
+        raise
+    _record_success(upstream)
+    return result
@@ -3,10 +3,15 @@ import boto3
 import uuid
 import os
 from openai import OpenAI
+from rateLimiter import limited_call
+from idempotency import idempotent
+from responseBuilder import build_response, decode_body
+import circuitBreaker
 import requests
 import time
 from botocore.exceptions import NoCredentialsError
-from concurrent.futures import ThreadPoolExecutor
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 # S3 Configuration
 S3_BUCKET = "mail.mysterie.co.za"
@@ -17,20 +22,40 @@ API_URL = 'https://api.us1.bfl.ai/v1'
 
 # Flux API Key
 API_KEY = os.environ.get("FLUX_API_KEY")
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+# Retries are left to rateLimiter.limited_call so each attempt is budgeted and deadline-capped
+client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"), max_retries=0)
 HEADERS = {
     "accept": "application/json",
     "x-key": API_KEY,
     "Content-Type": "application/json",
 }
 
+# Image generation configuration. Providers are tried in the order listed: every
+# image starts on the first provider, and after HEDGE_DELAY seconds any image that
+# is still missing is also requested from the next provider. First N results win.
+IMAGE_COUNT = 4
+# Both providers render at this size so hedged responses never mix aspect ratios
+IMAGE_WIDTH = 1024
+IMAGE_HEIGHT = 1024
+IMAGE_PROVIDERS = [p.strip() for p in os.environ.get("IMAGE_PROVIDERS", "openai,flux").split(",") if p.strip()]
+HEDGE_DELAY = float(os.environ.get("IMAGE_HEDGE_DELAY_SECONDS", "12"))
+FLUX_FAILED_STATUSES = ("Error", "Request Moderated", "Content Moderated", "Task not found")
+
+# Downstream timeouts in seconds, further capped by the request deadline
+FLUX_TIMEOUT = 10
+DOWNLOAD_TIMEOUT = 20
+
 # Initialize S3 client
 s3_client = boto3.client("s3")
 
-def generate_image_OpenAI(prompt, width=1024, height=1024):
+def generate_image_OpenAI(prompt, width=IMAGE_WIDTH, height=IMAGE_HEIGHT, cancelled=None):
     """ Calls DALL·E 3 to generate an image based on the prompt. """
     try:
-        response = client.images.generate(
+        response = limited_call(
+            "dall-e-3",
+            0,
+            client.images.with_raw_response.generate,
+            cancelled=cancelled,
             model="dall-e-3",
             prompt=prompt,
             n=1,
@@ -41,24 +66,28 @@ def generate_image_OpenAI(prompt, width=1024, height=1024):
         print(f"Error generating image: {e}")
         return None
 
-def generate_image_Flux(prompt, width=1024, height=768):
+def generate_image_Flux(prompt, width=IMAGE_WIDTH, height=IMAGE_HEIGHT):
     """ Calls Flux API to generate an image based on the prompt. """
-    try:
+    def submit(timeout):
         response = requests.post(
             f"{API_URL}/flux-dev",
             headers=HEADERS,
             json={"prompt": prompt, "width": width, "height": height},
+            timeout=timeout,
         )
         response.raise_for_status()
         return response.json()  # Assuming Flux returns an "id" field
-    except requests.exceptions.RequestException as e:
+
+    try:
+        return circuitBreaker.call("flux", submit, timeout=FLUX_TIMEOUT)
+    except (requests.exceptions.RequestException, circuitBreaker.CircuitOpenError, circuitBreaker.DeadlineExceeded) as e:
         print(f"Error generating image: {e}")
         return None
 
 def upload_to_s3(image_url):
     """ Downloads the generated image and uploads it to S3, returning a pre-signed URL. """
     try:
-        response = requests.get(image_url)
+        response = requests.get(image_url, timeout=circuitBreaker.cap_timeout(DOWNLOAD_TIMEOUT))
         response.raise_for_status()
         image_data = response.content
 
@@ -70,50 +99,129 @@ def upload_to_s3(image_url):
             Params={"Bucket": S3_BUCKET, "Key": filename},
             ExpiresIn=EXPIRATION
         )
-    except (requests.exceptions.RequestException, NoCredentialsError) as e:
+    except (requests.exceptions.RequestException, NoCredentialsError, circuitBreaker.DeadlineExceeded) as e:
         print(f"Error uploading image: {e}")
         return None
 
-def poll_for_result(request_id, poll_interval=0.5):
-    while True:
-        result = requests.get(
+def poll_for_result(request_id, poll_interval=0.5, cancelled=None):
+    def fetch(timeout):
+        response = requests.get(
             f'{API_URL}/get_result',
             headers=HEADERS,
             params={'id': request_id},
-        ).json()
+            timeout=timeout,
+        )
+        response.raise_for_status()
+        return response.json()
+
+    while not (cancelled and cancelled.is_set()):
+        result = circuitBreaker.call("flux", fetch, timeout=FLUX_TIMEOUT)
         if result["status"] == "Ready":
             return result['result']['sample']
+        if result["status"] in FLUX_FAILED_STATUSES:
+            print(f"Flux generation {request_id} failed: {result['status']}")
+            return None
         time.sleep(poll_interval)
+    return None
 
-def process_image(prompt):
-    """ Generates an image and uploads it to S3, returning the presigned URL. """
-    request = generate_image(prompt)
+def process_image(prompt, cancelled=None):
+    """ Generates an image with Flux and uploads it to S3, returning the presigned URL. """
+    request = generate_image_Flux(prompt, IMAGE_WIDTH, IMAGE_HEIGHT)
     
     if request and "id" in request:
-        image_url = poll_for_result(request["id"])
-        if image_url:
+        image_url = poll_for_result(request["id"], cancelled=cancelled)
+        if image_url and not (cancelled and cancelled.is_set()):
             return upload_to_s3(image_url)
     return None
 
-def process_image_OPEN_AI(prompt):
+def process_image_OPEN_AI(prompt, cancelled=None):
     """ Generates an image and uploads it to S3, returning the presigned URL. """
-    URL = generate_image_OpenAI(prompt)
+    URL = generate_image_OpenAI(prompt, IMAGE_WIDTH, IMAGE_HEIGHT, cancelled)
     
-    if URL :
+    if URL and not (cancelled and cancelled.is_set()):
         return upload_to_s3(URL)
     return None
 
+PROVIDERS = {
+    "openai": process_image_OPEN_AI,
+    "flux": process_image,
+}
+
+def check_providers(providers):
+    """Fail at cold start, not per request, if IMAGE_PROVIDERS is empty or names an unknown provider."""
+    unknown = [p for p in providers if p not in PROVIDERS]
+    if not providers or unknown:
+        raise ValueError(f"IMAGE_PROVIDERS must list providers from {sorted(PROVIDERS)}, got {providers}")
+
+check_providers(IMAGE_PROVIDERS)
+
+def generate_images_hedged(prompt, count=IMAGE_COUNT, providers=IMAGE_PROVIDERS, hedge_delay=HEDGE_DELAY):
+    """
+    Generates `count` images, hedging slow or failed generations onto the next provider.
+    Returns as soon as `count` presigned URLs are ready; stragglers are cancelled and ignored.
+    """
+    cancelled = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=count * len(providers))
+    pending = {}
+    image_urls = []
+    next_tier = 1
+    next_hedge_at = time.monotonic() + hedge_delay
+
+    def launch(provider, n):
+        for _ in range(n):
+            pending[executor.submit(PROVIDERS[provider], prompt, cancelled)] = (provider, time.monotonic())
+
+    launch(providers[0], count)
+    try:
+        while len(image_urls) < count and (pending or next_tier < len(providers)):
+            timeout = max(0.0, next_hedge_at - time.monotonic()) if next_tier < len(providers) else None
+            left = circuitBreaker.remaining()
+            if left is not None:
+                if left <= 0:
+                    print(f"Deadline reached with {len(image_urls)} of {count} images ready")
+                    break
+                timeout = left if timeout is None else min(timeout, left)
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                provider, started = pending.pop(future)
+                try:
+                    url = future.result()
+                except Exception as e:
+                    print(f"Error generating image with {provider}: {e}")
+                    url = None
+                print(f"{provider} image {'ready' if url else 'failed'} in {time.monotonic() - started:.2f}s")
+                if url:
+                    image_urls.append(url)
+
+            # Hedge once the delay has passed, or immediately if everything in flight has finished short.
+            missing = count - len(image_urls)
+            if missing > 0 and next_tier < len(providers) and (time.monotonic() >= next_hedge_at or not pending):
+                launch(providers[next_tier], missing)
+                next_tier += 1
+                next_hedge_at = time.monotonic() + hedge_delay
+    finally:
+        cancelled.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return image_urls[:count]
+
+# Replays hand back presigned URLs, so never replay past half their lifetime
+@idempotent("createImages", max_ttl=EXPIRATION // 2)
 def lambda_handler(event, context):
     """ AWS Lambda handler function. """
+    circuitBreaker.start_request(context)
     try:
-        body = event["body"]
+        body = decode_body(event)
         prompt = body
 
-        image_urls = []
-        with ThreadPoolExecutor(max_workers=4) as executor:
-            results = executor.map(process_image_OPEN_AI, [prompt] * 4)
-
-        image_urls = [url for url in results if url]
+        image_urls = generate_images_hedged(prompt)
+        if not image_urls:
+            return {
+                "statusCode": 502,
+                "headers": {"Access-Control-Allow-Origin": "*"},
+                "body": json.dumps({"error": "Image generation failed, please retry"})
+            }
 
         headers = {
             "Content-Type": "application/json",
@@ -122,11 +230,7 @@ def lambda_handler(event, context):
             "Access-Control-Allow-Headers": "Content-Type"
         }
 
-        return {
-            "statusCode": 200,
-            "headers": headers,
-            "body": json.dumps({"imageUrl": image_urls})
-        }
+        return build_response(event, 200, {"imageUrl": image_urls}, headers)
     except Exception as e:
         print(f"Error: {e}")
         return {
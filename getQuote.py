@@ -38,9 +38,10 @@ def subtract_quote_credit(email):
     try:
         response = table.update_item(
             Key={'email': email},
-            UpdateExpression="SET quote = quote - :dec",
+            UpdateExpression="SET quote = quote - :dec, #version = if_not_exists(#version, :zero) + :one",
             ConditionExpression="quote > :zero",
-            ExpressionAttributeValues={":dec": 1, ":zero": 0},
+            ExpressionAttributeNames={"#version": "version"},
+            ExpressionAttributeValues={":dec": 1, ":zero": 0, ":one": 1},
             ReturnValues="UPDATED_NEW"
         )
         
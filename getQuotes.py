@@ -1,12 +1,18 @@
 import json
+import time
 import boto3
 from decimal import Decimal
 from botocore.exceptions import ClientError
+from responseBuilder import build_response
 
 # Initialize DynamoDB resource
 dynamodb = boto3.resource('dynamodb')
 table = dynamodb.Table('quotes')
 
+# Warm-container cache of the catalog, with its compressed encodings kept alongside
+CATALOG_CACHE_TTL = 60  # seconds
+_catalog_cache = {"items": None, "expiresAt": 0, "encoded": {}}
+
 def convert_decimals(obj):
     """Recursively convert Decimal types to float/int for JSON serialization"""
     if isinstance(obj, Decimal):
@@ -25,17 +31,16 @@ def lambda_handler(event, context):
     }
 
     try:
-        # Scan the table to retrieve all items
-        response = table.scan()
+        if _catalog_cache["items"] is None or time.time() >= _catalog_cache["expiresAt"]:
+            # Scan the table to retrieve all items
+            response = table.scan()
 
-        # Convert Decimals to native types
-        items = [convert_decimals(item) for item in response.get('Items', [])]
+            # Convert Decimals to native types
+            _catalog_cache["items"] = json.dumps([convert_decimals(item) for item in response.get('Items', [])])
+            _catalog_cache["expiresAt"] = time.time() + CATALOG_CACHE_TTL
+            _catalog_cache["encoded"] = {}
 
-        return {
-            'statusCode': 200,
-            'headers': headers,
-            'body': json.dumps(items)
-        }
+        return build_response(event, 200, _catalog_cache["items"], headers, encoded_cache=_catalog_cache["encoded"])
 
     except ClientError as e:
         print(f"DynamoDB Error: {e.response['Error']['Message']}")
@@ -1,4 +1,8 @@
+import os
 import json
+import re
+import time
+import hashlib
 import boto3
 from decimal import Decimal
 from botocore.exceptions import ClientError
@@ -6,6 +10,19 @@ from botocore.exceptions import ClientError
 dynamodb = boto3.resource('dynamodb')
 table = dynamodb.Table('users')
 
+FIELD_NAME = re.compile(r'^[A-Za-z0-9_]+$')
+
+# Serialized records are kept in the warm container keyed by email and field selection.
+# The handlers that debit credits bump the record's `version` attribute in the same
+# update, so a cached copy is reused only after a one-attribute read confirms the
+# version is unchanged. The short TTL bounds staleness for writers that don't bump it
+# (e.g. credit top-ups made outside these functions).
+VERSION_FIELD = "version"
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL_SECONDS", "2"))
+USER_CACHE_MAX_ENTRIES = 1000
+
+_user_cache = {}
+
 def convert_decimals(obj):
     """Recursively convert Decimal types to float/int for JSON serialization"""
     if isinstance(obj, Decimal):
@@ -16,15 +33,89 @@ def convert_decimals(obj):
         return [convert_decimals(v) for v in obj]
     return obj
 
+def parse_fields(query):
+    """Parse the optional comma-separated 'fields' parameter into a sorted tuple, or None for all attributes"""
+    raw = (query or {}).get("fields")
+    if not raw:
+        return None
+    fields = tuple(sorted({f.strip() for f in raw.split(",") if f.strip()}))
+    if not fields or not all(FIELD_NAME.match(f) for f in fields):
+        raise ValueError("Invalid fields parameter")
+    return fields
+
+def fetch_user(email, fields):
+    """Read the user, projecting only the requested attributes (plus version) when fields are given"""
+    if fields is None:
+        return table.get_item(Key={'email': email})
+    projected = fields if VERSION_FIELD in fields else fields + (VERSION_FIELD,)
+    names = {f"#f{i}": field for i, field in enumerate(projected)}
+    return table.get_item(
+        Key={'email': email},
+        ProjectionExpression=", ".join(names),
+        ExpressionAttributeNames=names
+    )
+
+def fetch_version(email):
+    """Read only the record's version; None when the user no longer exists"""
+    response = table.get_item(
+        Key={'email': email},
+        ProjectionExpression="#v",
+        ExpressionAttributeNames={"#v": VERSION_FIELD}
+    )
+    if 'Item' not in response:
+        return None
+    return response['Item'].get(VERSION_FIELD, 0)
+
+def read_user(email, fields):
+    """Return (body, etag) for the user's selected fields, or None if the user does not exist"""
+    cache_key = (email, fields)
+    cached = _user_cache.get(cache_key)
+    if cached and time.monotonic() < cached["expiresAt"] and fetch_version(email) == cached["version"]:
+        return cached["body"], cached["etag"]
+
+    response = fetch_user(email, fields)
+    if 'Item' not in response:
+        _user_cache.pop(cache_key, None)
+        return None
+
+    # Convert Decimals to native types
+    item = convert_decimals(response['Item'])
+    version = item.get(VERSION_FIELD, 0)
+    if fields is not None and VERSION_FIELD not in fields:
+        item.pop(VERSION_FIELD, None)
+    body = json.dumps(item, sort_keys=True)
+    etag = make_etag(body)
+
+    if len(_user_cache) >= USER_CACHE_MAX_ENTRIES:
+        _user_cache.clear()
+    _user_cache[cache_key] = {
+        "version": version,
+        "body": body,
+        "etag": etag,
+        "expiresAt": time.monotonic() + USER_CACHE_TTL,
+    }
+    return body, etag
+
+def make_etag(body):
+    return '"' + hashlib.sha256(body.encode("utf-8")).hexdigest()[:32] + '"'
+
+def if_none_match(event, etag):
+    request_headers = {k.lower(): v for k, v in (event.get("headers") or {}).items()}
+    candidates = [tag.strip() for tag in request_headers.get("if-none-match", "").split(",")]
+    return etag in candidates or f"W/{etag}" in candidates or "*" in candidates
+
 def lambda_handler(event, context):
     # CORS headers
     headers = {
         'Access-Control-Allow-Origin': '*',
-        'Content-Type': 'application/json'
+        'Content-Type': 'application/json',
+        'Cache-Control': 'no-cache',
+        'Access-Control-Expose-Headers': 'ETag'
     }
 
     try:
-        email = event.get("queryStringParameters", {}).get("email")
+        query = event.get("queryStringParameters") or {}
+        email = query.get("email")
         
         if not email:
             return {
@@ -33,23 +124,35 @@ def lambda_handler(event, context):
                 'body': json.dumps({'error': 'Email parameter is required'})
             }
 
-        # Get item from DynamoDB
-        response = table.get_item(Key={'email': email})
-        
-        if 'Item' not in response:
+        try:
+            fields = parse_fields(query)
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': str(e)})
+            }
+        user = read_user(email, fields)
+        if user is None:
             return {
                 'statusCode': 404,
                 'headers': headers,
                 'body': json.dumps({'error': 'User not found'})
             }
+        body, etag = user
 
-        # Convert Decimals to native types
-        item = convert_decimals(response['Item'])
+        headers['ETag'] = etag
+        if if_none_match(event, etag):
+            return {
+                'statusCode': 304,
+                'headers': headers,
+                'body': ''
+            }
 
         return {
             'statusCode': 200,
             'headers': headers,
-            'body': json.dumps(item)
+            'body': body
         }
 
     except json.JSONDecodeError:
@@ -0,0 +1,198 @@
+import json
+import os
+import time
+import math
+import base64
+import hashlib
+import logging
+import functools
+import boto3
+from botocore.exceptions import ClientError, BotoCoreError
+from responseBuilder import build_response, decompress, decode_body
+
+# Deduplicates retried requests to the paid endpoints. The first request for a key
+# writes an IN_PROGRESS marker with a conditional put; duplicates either wait for it
+# to finish and replay the stored response, or get a 409 if it is still running.
+dynamodb = boto3.resource('dynamodb')
+IDEMPOTENCY_TABLE = os.environ.get("IDEMPOTENCY_TABLE", "idempotency")
+
+# How long completed responses are replayed. Keys the client sends are deliberate
+# retries; keys derived from email plus body are kept short so a repeated search or
+# a deliberate "regenerate" a few minutes later runs again.
+RESULT_TTL = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", "3600"))
+HASH_KEY_TTL = int(os.environ.get("IDEMPOTENCY_HASH_TTL_SECONDS", "300"))
+IN_PROGRESS_TIMEOUT = 900  # lock length when there is no Lambda context to size it from
+LOCK_SLACK = 5  # seconds past the owner's own timeout before a retry may take the key over
+WAIT_FOR_IN_PROGRESS = float(os.environ.get("IDEMPOTENCY_WAIT_SECONDS", "5"))
+POLL_INTERVAL = 0.25
+
+IN_PROGRESS = "IN_PROGRESS"
+COMPLETED = "COMPLETED"
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+def idempotency_key(event, scope):
+    """
+    Return (key, ttl) from the client's Idempotency-Key header, or from a hash of
+    email plus body. Returns (None, None) when neither is available, since a
+    body-only hash would let different users replay each other's responses.
+    """
+    headers = {k.lower(): v for k, v in (event.get("headers") or {}).items()}
+    email = (event.get("queryStringParameters") or {}).get("email", "")
+
+    if headers.get("idempotency-key"):
+        return f"{scope}#{email}#{headers['idempotency-key']}", RESULT_TTL
+    if not email:
+        return None, None
+
+    body = decode_body(event) or ""
+    if not isinstance(body, str):
+        body = json.dumps(body, sort_keys=True)
+    digest = hashlib.sha256(f"{email}\n{body}".encode("utf-8")).hexdigest()
+    return f"{scope}#{digest}", HASH_KEY_TTL
+
+
+def _lock_until(context, now):
+    """The owner can run no longer than its own remaining time, so the lock need not either."""
+    if context is not None and hasattr(context, "get_remaining_time_in_millis"):
+        return now + math.ceil(context.get_remaining_time_in_millis() / 1000) + LOCK_SLACK
+    return now + IN_PROGRESS_TIMEOUT
+
+
+def _claim(table, key, now, locked_until, ttl):
+    """Write the IN_PROGRESS marker. Returns True if this invocation owns the key."""
+    try:
+        table.put_item(
+            Item={
+                'idempotencyKey': key,
+                'status': IN_PROGRESS,
+                'lockedUntil': locked_until,
+                'expiresAt': max(now + ttl, locked_until),
+            },
+            ConditionExpression="attribute_not_exists(idempotencyKey) OR expiresAt < :now "
+                                "OR (#s = :in_progress AND lockedUntil < :now)",
+            ExpressionAttributeNames={"#s": "status"},
+            ExpressionAttributeValues={":now": now, ":in_progress": IN_PROGRESS},
+        )
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+
+
+def _strip_encoding(response):
+    """
+    Undo the response's content encoding so the stored copy can be re-negotiated
+    against each duplicate's Accept-Encoding. Returns (response, negotiated).
+    """
+    headers = response.get("headers") or {}
+    encoding = headers.get("Content-Encoding")
+    if not (response.get("isBase64Encoded") and encoding):
+        return response, False
+    body = decompress(base64.b64decode(response["body"]), encoding).decode("utf-8")
+    headers = {k: v for k, v in headers.items() if k not in ("Content-Encoding", "Vary")}
+    return {"statusCode": response["statusCode"], "headers": headers, "body": body}, True
+
+
+def _complete(table, key, response, ttl):
+    stored, negotiated = _strip_encoding(response)
+    try:
+        table.put_item(Item={
+            'idempotencyKey': key,
+            'status': COMPLETED,
+            'response': json.dumps(stored),
+            'negotiated': negotiated,
+            'expiresAt': int(time.time()) + ttl,
+        })
+    except (ClientError, BotoCoreError) as e:
+        # Most likely an oversized response; drop the marker so retries run normally.
+        logger.warning(f"Failed to store idempotent response: {str(e)}")
+        _release(table, key)
+
+
+def _release(table, key):
+    try:
+        table.delete_item(Key={'idempotencyKey': key})
+    except (ClientError, BotoCoreError) as e:
+        logger.warning(f"Failed to release idempotency marker: {str(e)}")
+
+
+def _replay(item, event):
+    response = json.loads(item['response'])
+    if item.get('negotiated'):
+        response = build_response(event, response["statusCode"], response["body"], response.get("headers"))
+    response["headers"] = {**response.get("headers", {}), "Idempotent-Replayed": "true"}
+    return response
+
+
+def _wait_for_result(table, key, event):
+    """Poll the owner's marker until it completes, or return None if it is still running."""
+    deadline = time.monotonic() + WAIT_FOR_IN_PROGRESS
+    while True:
+        item = table.get_item(Key={'idempotencyKey': key}, ConsistentRead=True).get('Item')
+        if item is None:
+            return None
+        if item['status'] == COMPLETED:
+            return _replay(item, event)
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(POLL_INTERVAL)
+
+
+def _conflict():
+    return {
+        "statusCode": 409,
+        "headers": {"Access-Control-Allow-Origin": "*", "Retry-After": "5"},
+        "body": json.dumps({"error": "An identical request is already being processed"})
+    }
+
+
+def idempotent(scope, max_ttl=None):
+    """
+    Decorator for Lambda handlers whose work is expensive or debits credits. Only
+    2xx responses are stored for replay; anything else releases the key so the
+    client can retry. `max_ttl` caps how long a result is replayed, for responses
+    that carry something short-lived such as presigned URLs. If the table is
+    unavailable the handler runs unprotected.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            key, ttl = idempotency_key(event, scope)
+            if key is None:
+                return handler(event, context)
+            if max_ttl is not None:
+                ttl = min(ttl, max_ttl)
+            table = dynamodb.Table(IDEMPOTENCY_TABLE)
+
+            try:
+                now = int(time.time())
+                owned = _claim(table, key, now, _lock_until(context, now), ttl)
+                if not owned:
+                    replay = _wait_for_result(table, key, event)
+                    if replay is not None:
+                        return replay
+                    # The owner may have released the key after a failure; try to take it over once.
+                    now = int(time.time())
+                    if not _claim(table, key, now, _lock_until(context, now), ttl):
+                        return _conflict()
+            except (ClientError, BotoCoreError) as e:
+                logger.warning(f"Idempotency table unavailable, running without deduplication: {str(e)}")
+                return handler(event, context)
+
+            try:
+                response = handler(event, context)
+            except Exception:
+                _release(table, key)
+                raise
+
+            if 200 <= response.get("statusCode", 500) < 300:
+                _complete(table, key, response, ttl)
+            else:
+                _release(table, key)
+            return response
+        return wrapper
+    return decorator
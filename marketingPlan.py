@@ -6,19 +6,50 @@ from botocore.exceptions import ClientError
 from decimal import Decimal
 from typing import Dict, Any
 import uuid
-from openai import OpenAI
+from openai import OpenAI, APITimeoutError
+from rateLimiter import limited_call, estimate_tokens, RateLimitExceeded, RequestTooLarge
+from idempotency import idempotent
+from responseBuilder import decode_body
+from circuitBreaker import start_request, remaining, CircuitOpenError, DeadlineExceeded, TIMEOUT_RETRY_AFTER
 import requests
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
 
 # Initialize DynamoDB client
 dynamodb = boto3.resource('dynamodb')
 USERS_TABLE = "users"
 
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+# Retries are left to rateLimiter.limited_call so each attempt is budgeted and deadline-capped
+client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"), max_retries=0)
+_section_client = None  # see get_section_client
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+PLAN_MAX_TOKENS = 1000
+
+# Sectioned mode: each section is generated concurrently with its own token budget
+# and assembled in this order. "single" keeps the original one-shot plan.
+PLAN_MODE = os.environ.get("MARKETING_PLAN_MODE", "single")
+SECTION_TIMEOUT = float(os.environ.get("MARKETING_SECTION_TIMEOUT_SECONDS", "20"))
+SECTIONED_SHARE = 0.5  # share of the remaining deadline the sectioned phase may use, leaving room for the fallback
+MIN_SECTION_BUDGET = 2  # seconds; with less than this, go straight to single-shot
+PLAN_SECTIONS = [
+    ("Target Audience", "Describe the target customer segments, their needs and where to reach them.", 350),
+    ("Positioning & Messaging", "Describe the value proposition, key messages and tone.", 300),
+    ("Marketing Channels", "Recommend the channels to use and the tactics for each.", 450),
+    ("Budget", "Propose a budget split across the recommended channels with rough amounts.", 300),
+    ("Timeline", "Lay out a phased timeline with milestones for the first few months.", 350),
+    ("Success Metrics", "List the KPIs to track and the targets for each.", 250),
+]
+SECTION_PROMPT = """You are writing one section of a marketing plan for the business request below.
+Write ONLY the "{title}" section, starting with the heading "## {title}". {instruction}
+Do not write any other sections, an introduction or a conclusion.
+
+Business request:
+{request}"""
+
 def check_email_doctor_search_credits(email):
     table = dynamodb.Table(USERS_TABLE)
     response = table.get_item(Key={'email': email})
@@ -40,9 +71,10 @@ def subtract_marketing_credit(email):
     try:
         response = table.update_item(
             Key={'email': email},
-            UpdateExpression="SET marketing = marketing - :dec",
+            UpdateExpression="SET marketing = marketing - :dec, #version = if_not_exists(#version, :zero) + :one",
             ConditionExpression="marketing > :zero",
-            ExpressionAttributeValues={":dec": 1, ":zero": 0},
+            ExpressionAttributeNames={"#version": "version"},
+            ExpressionAttributeValues={":dec": 1, ":zero": 0, ":one": 1},
             ReturnValues="UPDATED_NEW"
         )
         
@@ -55,6 +87,107 @@ def subtract_marketing_credit(email):
         else:
             return {"success": False, "message": "Error updating item", "error": str(e)}
 
+def generate_single_plan(prompt):
+    """Generates the whole plan in one completion."""
+    response = limited_call(
+        "gpt-4o",
+        estimate_tokens(prompt, PLAN_MAX_TOKENS),
+        client.chat.completions.with_raw_response.create,
+        model="gpt-4o",
+        messages=[
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ],
+        max_tokens=PLAN_MAX_TOKENS,
+    )
+    return response.choices[0].message.content
+
+def generate_section(prompt, title, instruction, max_tokens, section_client, timeout, cancelled):
+    if cancelled.is_set():
+        return None
+    content = SECTION_PROMPT.format(title=title, instruction=instruction, request=prompt)
+    response = limited_call(
+        "gpt-4o",
+        estimate_tokens(content, max_tokens),
+        section_client.chat.completions.with_raw_response.create,
+        model="gpt-4o",
+        messages=[{"role": "user", "content": content}],
+        max_tokens=max_tokens,
+        timeout=timeout,
+        cancelled=cancelled,
+        max_wait=timeout,
+    )
+    choice = response.choices[0]
+    if choice.finish_reason == "length":
+        logger.warning(f"Section '{title}' hit its {max_tokens} token budget")
+    return choice.message.content
+
+def get_section_client():
+    """
+    Sections run on their own client so an abandoned phase can abort them by closing
+    it. The client is kept for the warm container and only replaced after such an
+    abort, so successful phases reuse its pooled connections.
+    """
+    global _section_client
+    if _section_client is None:
+        _section_client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"), max_retries=0)
+    return _section_client
+
+def abort_sections(section_client):
+    global _section_client
+    if _section_client is section_client:
+        _section_client = None
+    section_client.close()
+
+def generate_sectioned_plan(prompt):
+    """
+    Generates every section concurrently and joins them in order. Returns None as soon
+    as any section fails or the phase runs out of time, so the caller can fall back to
+    single-shot. The phase only gets part of the remaining deadline, and sections still
+    running when it gives up are aborted by closing the section client.
+    """
+    budget = SECTION_TIMEOUT
+    left = remaining()
+    if left is not None:
+        budget = min(budget, left * SECTIONED_SHARE)
+    if budget < MIN_SECTION_BUDGET:
+        logger.warning(f"Only {budget:.1f}s for sectioned generation, using single-shot")
+        return None
+
+    start = time.monotonic()
+    cancelled = threading.Event()
+    section_client = get_section_client()
+    executor = ThreadPoolExecutor(max_workers=len(PLAN_SECTIONS))
+    futures = [
+        executor.submit(generate_section, prompt, *section, section_client, budget, cancelled)
+        for section in PLAN_SECTIONS
+    ]
+    try:
+        done, not_done = wait(futures, timeout=budget, return_when=FIRST_EXCEPTION)
+        if not_done:
+            failed = [future for future in done if future.exception() is not None]
+            if failed:
+                raise failed[0].exception()
+            logger.warning(f"{len(not_done)} marketing plan sections timed out")
+            return None
+        sections = [future.result() for future in futures]
+    except RateLimitExceeded:
+        raise
+    except Exception as e:
+        logger.warning(f"Sectioned marketing plan failed: {str(e)}")
+        return None
+    finally:
+        cancelled.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+        if not all(future.done() for future in futures):
+            abort_sections(section_client)
+
+    logger.info(f"Sectioned marketing plan generated in {time.monotonic() - start:.2f}s")
+    return "\n\n".join(section.strip() for section in sections)
+
+@idempotent("marketingPlan")
 def lambda_handler(event, context):
     print(event)
     print(event.get("body", "No body"))
@@ -62,6 +195,7 @@ def lambda_handler(event, context):
     Lambda function to retrieve a marketing from the DynamoDB 'marketings' table 
     based on the provided email and compNameOfferering.
     """
+    start_request(context)
     try:
         email = event["queryStringParameters"].get("email")
         comp_name_offering = event["queryStringParameters"].get("compNameOfferering")
@@ -89,18 +223,13 @@ def lambda_handler(event, context):
                 "body": json.dumps({"error": "No marketing search credits available"})
             }
         
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "user",
-                    "content": event["body"]
-                }
-            ],
-            max_tokens=1000,
-        )
-        
-        analysis_result = response.choices[0].message.content  # Extract response content
+        mode = event["queryStringParameters"].get("mode", PLAN_MODE)
+        analysis_result = None
+        if mode == "sectioned":
+            analysis_result = generate_sectioned_plan(decode_body(event))
+        if analysis_result is None:
+            analysis_result = generate_single_plan(decode_body(event))
+
         subtract_marketing_credit(email)
         print(json.dumps(analysis_result))
         return {
@@ -109,6 +238,38 @@ def lambda_handler(event, context):
             "body": analysis_result
         }
     
+    except RequestTooLarge as e:
+        logger.warning(f"Rejecting oversized marketing request: {str(e)}")
+        return {
+            "statusCode": 413,
+            "headers": {"Access-Control-Allow-Origin": "*"},
+            "body": json.dumps({"error": "Request is too large to process"})
+        }
+
+    except RateLimitExceeded as e:
+        logger.warning(f"Shedding marketing request: {str(e)}")
+        return {
+            "statusCode": 429,
+            "headers": {"Access-Control-Allow-Origin": "*", "Retry-After": str(max(1, round(e.retry_after)))},
+            "body": json.dumps({"error": "Service busy, please retry shortly"})
+        }
+
+    except (CircuitOpenError, DeadlineExceeded) as e:
+        logger.warning(f"Upstream unavailable: {str(e)}")
+        return {
+            "statusCode": 503,
+            "headers": {"Access-Control-Allow-Origin": "*", "Retry-After": str(max(1, round(getattr(e, "retry_after", 1))))},
+            "body": json.dumps({"error": "Service temporarily unavailable, please retry shortly"})
+        }
+
+    except APITimeoutError as e:
+        logger.warning(f"OpenAI timed out: {str(e)}")
+        return {
+            "statusCode": 504,
+            "headers": {"Access-Control-Allow-Origin": "*", "Retry-After": str(TIMEOUT_RETRY_AFTER)},
+            "body": json.dumps({"error": "Upstream timed out, please retry shortly"})
+        }
+
     except ClientError as e:
         logger.error(f"DynamoDB error: {str(e)}")
         return {
@@ -6,6 +6,9 @@ import boto3
 from botocore.exceptions import ClientError
 from decimal import Decimal
 from typing import Dict, Any
+from idempotency import idempotent
+from responseBuilder import build_response, decode_body
+import circuitBreaker
 
 # Initialize DynamoDB client
 dynamodb = boto3.resource('dynamodb')
@@ -17,6 +20,7 @@ logger.setLevel(logging.INFO)
 
 GOOGLE_MAPS_API_KEY = os.environ.get('GOOGLE_MAPS_API_KEY')
 PLACES_API_BASE_URL = 'https://places.googleapis.com/v1'
+PLACES_TIMEOUT = 10  # seconds, further capped by the request deadline
 
 def check_email_doctor_search_credits(email):
     table = dynamodb.Table(TABLE_NAME)
@@ -42,9 +46,10 @@ def subtract_doctor_credit(email):
     try:
         response = table.update_item(
             Key={'email': email},
-            UpdateExpression="SET doctor = doctor - :dec",
+            UpdateExpression="SET doctor = doctor - :dec, #version = if_not_exists(#version, :zero) + :one",
             ConditionExpression="doctor > :zero",
-            ExpressionAttributeValues={":dec": 1, ":zero": 0},
+            ExpressionAttributeNames={"#version": "version"},
+            ExpressionAttributeValues={":dec": 1, ":zero": 0, ":one": 1},
             ReturnValues="UPDATED_NEW"
         )
         
@@ -60,6 +65,7 @@ def subtract_doctor_credit(email):
             return {"success": False, "message": "Error updating item", "error": str(e)}
 
 
+@idempotent("places")
 def lambda_handler(event, context):
     print("--------")
     print(event)
@@ -67,6 +73,7 @@ def lambda_handler(event, context):
     """
     Main Lambda handler that processes Places API requests
     """
+    circuitBreaker.start_request(context)
     try:
         email = event.get("queryStringParameters", {}).get("email")
         
@@ -94,14 +101,14 @@ def lambda_handler(event, context):
                 "body": json.dumps({"error": "No doctor search credits available"})
             }
 
-        body = event['body']
+        body = decode_body(event)
         if isinstance(body, str):  # If body is a string, parse it
             body = json.loads(body)
         action = body.get('action')
         params = body.get('params')
 
         if action == 'nearbySearch':
-            return handle_nearby_search(params,email)
+            return handle_nearby_search(params,email,event)
         else:
             return {
                 'statusCode': 400,
@@ -116,7 +123,7 @@ def lambda_handler(event, context):
             'body': json.dumps({'error': 'Internal server error'})
         }
 
-def handle_nearby_search(params,email) -> Dict[str, Any]:
+def handle_nearby_search(params,email,event=None) -> Dict[str, Any]:
     """
     Handle nearby search requests using Google Places API v2
     """
@@ -125,7 +132,7 @@ def handle_nearby_search(params,email) -> Dict[str, Any]:
         search_type = params.get('type', 'doctor')
         radius = params.get('radius', 5000)
 
-        url = f"https://places.googleapis.com/v1/places:searchNearby?key={GOOGLE_MAPS_API_KEY}"
+        url = f"{PLACES_API_BASE_URL}/places:searchNearby?key={GOOGLE_MAPS_API_KEY}"
         headers = {'Content-Type': 'application/json', 'X-Goog-Api-Key': GOOGLE_MAPS_API_KEY,"X-Goog-FieldMask": "*" }
         payload = {
             "includedTypes": [search_type],
@@ -138,20 +145,33 @@ def handle_nearby_search(params,email) -> Dict[str, Any]:
             }
         }
 
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        data = response.json()
+        def search(timeout):
+            response = requests.post(url, headers=headers, json=payload, timeout=timeout)
+            response.raise_for_status()
+            return response.json()
+
+        data = circuitBreaker.call("places", search, timeout=PLACES_TIMEOUT)
         credit_result = subtract_doctor_credit(email)
 
+        return build_response(event, 200, data)
+    except (circuitBreaker.CircuitOpenError, circuitBreaker.DeadlineExceeded) as e:
+        logger.warning(f'Nearby search unavailable: {str(e)}')
         return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps(data)
+            'statusCode': 503,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', 'Retry-After': str(max(1, round(getattr(e, 'retry_after', 1))))},
+            'body': json.dumps({'error': 'Places search temporarily unavailable'})
+        }
+    except requests.exceptions.Timeout as e:
+        logger.warning(f'Nearby search timed out: {str(e)}')
+        return {
+            'statusCode': 504,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', 'Retry-After': str(circuitBreaker.TIMEOUT_RETRY_AFTER)},
+            'body': json.dumps({'error': 'Places search timed out, please retry shortly'})
         }
     except requests.exceptions.RequestException as e:
         logger.error(f'Nearby search error: {str(e)}')
         return {
-            'statusCode': e.response.status_code if e.response else 500,
+            'statusCode': e.response.status_code if e.response is not None else 500,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'body': json.dumps({'error': 'Failed to search nearby places'})
         }
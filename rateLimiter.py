@@ -0,0 +1,342 @@
+import json
+import os
+import re
+import time
+import logging
+import threading
+import boto3
+from botocore.exceptions import ClientError, BotoCoreError
+from decimal import Decimal
+from openai import RateLimitError
+import circuitBreaker
+
+# Shared token-bucket limiter for OpenAI calls. Bucket state lives in DynamoDB so
+# every warm container draws from the same budget; if the table is unreachable we
+# fall back to an in-memory bucket for this container only.
+dynamodb = boto3.resource('dynamodb')
+RATE_LIMIT_TABLE = os.environ.get("RATE_LIMIT_TABLE", "rateLimits")
+
+# Requests-per-minute and tokens-per-minute budgets per model. A tpm of 0 means the
+# model is only limited on requests (e.g. image generation).
+DEFAULT_LIMITS = {
+    "gpt-4o": {"rpm": 500, "tpm": 30000},
+    "dall-e-3": {"rpm": 7, "tpm": 0},
+}
+MODEL_LIMITS = {**DEFAULT_LIMITS, **json.loads(os.environ.get("OPENAI_RATE_LIMITS", "{}"))}
+
+MAX_QUEUE_SECONDS = float(os.environ.get("RATE_LIMIT_MAX_QUEUE_SECONDS", "8"))
+DYNAMO_RETRY_AFTER = 60  # seconds to stay on the local fallback after a DynamoDB failure
+CONTENTION_BACKOFF = 0.05  # seconds to wait after losing a conditional write
+CLAMP_ATTEMPTS = 3  # conditional writes tried when applying upstream headers before giving up
+# Per-call OpenAI timeout. Kept below API Gateway's 29s integration limit (and the
+# functions' own timeouts) so a hanging call times out here and trips the breaker.
+OPENAI_TIMEOUT = float(os.environ.get("OPENAI_TIMEOUT_SECONDS", "25"))
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+_local_buckets = {}
+_local_lock = threading.Lock()
+_dynamo_disabled_until = 0.0
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a call would have to queue longer than the caller allows."""
+
+    def __init__(self, model, retry_after):
+        super().__init__(f"Rate limit budget exhausted for {model}, retry after {retry_after:.1f}s")
+        self.model = model
+        self.retry_after = retry_after
+
+
+class RequestTooLarge(Exception):
+    """Raised when a call needs more tokens than the model's whole per-minute budget; waiting will never help."""
+
+    def __init__(self, model, tokens, limit):
+        super().__init__(f"Request needs ~{tokens} tokens but {model} allows {limit} per minute")
+        self.model = model
+        self.tokens = tokens
+        self.limit = limit
+
+
+class CallCancelled(Exception):
+    """Raised when the caller abandoned a call while it was still queued for budget."""
+
+
+def estimate_tokens(text, max_tokens):
+    """Rough token estimate for a chat call: ~4 characters per prompt token plus the completion budget."""
+    return len(text or "") // 4 + max_tokens
+
+
+def _limits(model):
+    return MODEL_LIMITS.get(model, {"rpm": 60, "tpm": 0})
+
+
+def _refill(state, limits, now):
+    """Top up both buckets for the time elapsed since the state was last written."""
+    elapsed = max(0.0, now - state["updatedAt"])
+    state["requests"] = min(limits["rpm"], state["requests"] + elapsed * limits["rpm"] / 60.0)
+    if limits["tpm"]:
+        state["tokens"] = min(limits["tpm"], state["tokens"] + elapsed * limits["tpm"] / 60.0)
+    state["updatedAt"] = now
+    return state
+
+
+def _wait_needed(state, limits, tokens, now):
+    """Seconds until the bucket can cover this call, or 0 if it can be taken right now."""
+    if state["blockedUntil"] > now:
+        return state["blockedUntil"] - now
+    wait = 0.0
+    if state["requests"] < 1:
+        wait = (1 - state["requests"]) * 60.0 / limits["rpm"]
+    if limits["tpm"] and tokens:
+        if state["tokens"] < tokens:
+            wait = max(wait, (tokens - state["tokens"]) * 60.0 / limits["tpm"])
+    return wait
+
+
+def _new_state(limits, now):
+    return {"requests": float(limits["rpm"]), "tokens": float(limits["tpm"]), "updatedAt": now, "blockedUntil": 0.0}
+
+
+def _try_acquire_local(model, tokens, now):
+    limits = _limits(model)
+    with _local_lock:
+        state = _local_buckets.setdefault(model, _new_state(limits, now))
+        _refill(state, limits, now)
+        wait = _wait_needed(state, limits, tokens, now)
+        if wait <= 0:
+            state["requests"] -= 1
+            if limits["tpm"]:
+                state["tokens"] -= tokens
+        return wait
+
+
+def _to_decimal(value):
+    return Decimal(str(round(value, 6)))
+
+
+def _state_from_item(item):
+    return {
+        "requests": float(item["requests"]),
+        "tokens": float(item.get("tokens", 0)),
+        "updatedAt": float(item["updatedAt"]),
+        "blockedUntil": float(item.get("blockedUntil", 0)),
+    }
+
+
+def _put_state(table, model, state, **conditional):
+    table.put_item(
+        Item={
+            'bucket': model,
+            'requests': _to_decimal(state["requests"]),
+            'tokens': _to_decimal(state["tokens"]),
+            'updatedAt': _to_decimal(state["updatedAt"]),
+            'blockedUntil': _to_decimal(state["blockedUntil"]),
+        },
+        **conditional
+    )
+
+
+def _try_acquire_dynamo(model, tokens, now):
+    limits = _limits(model)
+    table = dynamodb.Table(RATE_LIMIT_TABLE)
+    item = table.get_item(Key={'bucket': model}, ConsistentRead=True).get('Item')
+    state = _state_from_item(item) if item else _new_state(limits, now)
+
+    _refill(state, limits, now)
+    wait = _wait_needed(state, limits, tokens, now)
+    if wait > 0:
+        return wait
+
+    state["requests"] -= 1
+    if limits["tpm"]:
+        state["tokens"] -= tokens
+
+    # Optimistic concurrency: only commit if nobody else has written the bucket since we read it.
+    conditional = {"ConditionExpression": "attribute_not_exists(#b)", "ExpressionAttributeNames": {"#b": "bucket"}}
+    if item:
+        conditional = {"ConditionExpression": "updatedAt = :prev", "ExpressionAttributeValues": {":prev": item["updatedAt"]}}
+
+    try:
+        _put_state(table, model, state, **conditional)
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return CONTENTION_BACKOFF
+        raise
+    return 0.0
+
+
+def _try_acquire(model, tokens):
+    global _dynamo_disabled_until
+    now = time.time()
+    if now >= _dynamo_disabled_until:
+        try:
+            return _try_acquire_dynamo(model, tokens, now)
+        except (ClientError, BotoCoreError) as e:
+            logger.warning(f"Rate limit table unavailable, using local bucket: {str(e)}")
+            _dynamo_disabled_until = now + DYNAMO_RETRY_AFTER
+    return _try_acquire_local(model, tokens, now)
+
+
+def _emit_metric(model, queue_ms, shed):
+    """Publish queueing delay as a CloudWatch embedded metric (picked up from the Lambda log stream)."""
+    print(json.dumps({
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": "medicalSuite/OpenAI",
+                "Dimensions": [["model"]],
+                "Metrics": [
+                    {"Name": "RateLimitQueueDelay", "Unit": "Milliseconds"},
+                    {"Name": "RateLimitShed", "Unit": "Count"},
+                ],
+            }],
+        },
+        "model": model,
+        "RateLimitQueueDelay": round(queue_ms, 1),
+        "RateLimitShed": 1 if shed else 0,
+    }))
+
+
+def acquire(model, tokens=0, max_wait=None, cancelled=None):
+    """
+    Take one request (and `tokens` tokens) from the model's budget, sleeping if the
+    bucket will refill within `max_wait` seconds. Raises RateLimitExceeded instead of
+    queueing when it will not, so callers shed load without burning the invocation.
+    Returns the time spent queueing in seconds. Raises RequestTooLarge if the call
+    could never fit in the budget, and CallCancelled if `cancelled` is set while
+    queueing, so abandoned calls stop waiting and take nothing from the bucket.
+    """
+    limits = _limits(model)
+    if limits["tpm"] and tokens > limits["tpm"]:
+        raise RequestTooLarge(model, tokens, limits["tpm"])
+
+    max_wait = MAX_QUEUE_SECONDS if max_wait is None else max_wait
+    left = circuitBreaker.remaining()
+    if left is not None:
+        max_wait = min(max_wait, left)
+    start = time.monotonic()
+
+    while True:
+        if cancelled is not None and cancelled.is_set():
+            raise CallCancelled(f"Abandoned {model} call while queued")
+        wait = _try_acquire(model, tokens)
+        waited = time.monotonic() - start
+        if wait <= 0:
+            _emit_metric(model, waited * 1000, shed=False)
+            return waited
+        if waited + wait > max_wait:
+            _emit_metric(model, waited * 1000, shed=True)
+            raise RateLimitExceeded(model, wait)
+        if cancelled is not None:
+            cancelled.wait(wait)
+        else:
+            time.sleep(wait)
+
+
+def _parse_duration(value):
+    """Parse OpenAI reset durations such as '1s', '6m0s' or '20ms' into seconds."""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    units = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+    parts = re.findall(r"([\d.]+)(ms|h|m|s)", value)
+    if not parts:
+        return None
+    return sum(float(amount) * units[unit] for amount, unit in parts)
+
+
+def _apply_headers(state, remaining_requests, remaining_tokens, blocked_until):
+    if remaining_requests is not None:
+        state["requests"] = min(state["requests"], remaining_requests)
+    if remaining_tokens is not None:
+        state["tokens"] = min(state["tokens"], remaining_tokens)
+    if blocked_until:
+        state["blockedUntil"] = max(state["blockedUntil"], blocked_until)
+
+
+def record_rate_limit_headers(model, headers):
+    """
+    Feed upstream rate-limit headers back into the shared bucket: remaining budgets
+    clamp our estimate down, and Retry-After blocks the bucket until it expires.
+    """
+    if not headers:
+        return
+    now = time.time()
+
+    remaining_requests = headers.get("x-ratelimit-remaining-requests")
+    remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+    remaining_requests = float(remaining_requests) if remaining_requests is not None else None
+    remaining_tokens = float(remaining_tokens) if remaining_tokens is not None else None
+
+    retry_after = _parse_duration(headers.get("retry-after"))
+    blocked_until = now + retry_after if retry_after else 0.0
+
+    with _local_lock:
+        state = _local_buckets.get(model)
+        if state:
+            _apply_headers(state, remaining_requests, remaining_tokens, blocked_until)
+
+    if now < _dynamo_disabled_until:
+        return
+
+    try:
+        _clamp_dynamo(model, remaining_requests, remaining_tokens, blocked_until, now)
+    except (ClientError, BotoCoreError) as e:
+        logger.warning(f"Failed to record rate limit headers: {str(e)}")
+
+
+def _clamp_dynamo(model, remaining_requests, remaining_tokens, blocked_until, now):
+    """
+    Apply upstream headers to the shared bucket with the same optimistic read-modify-write
+    as acquire, so they can only lower the budget: an account whose real limit is above
+    ours must not refill the bucket on every response.
+    """
+    limits = _limits(model)
+    table = dynamodb.Table(RATE_LIMIT_TABLE)
+    for _ in range(CLAMP_ATTEMPTS):
+        item = table.get_item(Key={'bucket': model}, ConsistentRead=True).get('Item')
+        if not item:
+            return
+        state = _state_from_item(item)
+        _refill(state, limits, max(now, state["updatedAt"]))
+        _apply_headers(state, remaining_requests, remaining_tokens, blocked_until)
+        try:
+            _put_state(table, model, state, ConditionExpression="updatedAt = :prev",
+                       ExpressionAttributeValues={":prev": item["updatedAt"]})
+            return
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+
+def limited_call(bucket_model, estimated_tokens, create, /, cancelled=None, max_wait=None, **kwargs):
+    """
+    Run an OpenAI `with_raw_response` call under the shared budget and the "openai"
+    circuit breaker, with its timeout capped by the request deadline, and return the
+    parsed result. A 429 from upstream is recorded and retried once if the advertised
+    wait fits within the queue budget; otherwise RateLimitExceeded is raised.
+    `bucket_model` picks the budget; `kwargs` (including `model`) go to `create`.
+    `cancelled` is an optional threading.Event marking calls the caller abandoned, and
+    `max_wait` caps queueing below RATE_LIMIT_MAX_QUEUE_SECONDS.
+    The clients must be built with max_retries=0 so every attempt passes through here.
+    """
+    timeout = kwargs.pop("timeout", OPENAI_TIMEOUT)
+    for attempt in range(2):
+        acquire(bucket_model, estimated_tokens, max_wait=max_wait, cancelled=cancelled)
+        if cancelled is not None and cancelled.is_set():
+            raise CallCancelled(f"Abandoned {bucket_model} call after queueing")
+        try:
+            raw = circuitBreaker.call("openai", create, timeout=timeout, cancelled=cancelled, **kwargs)
+        except RateLimitError as e:
+            record_rate_limit_headers(bucket_model, e.response.headers)
+            if attempt:
+                retry_after = _parse_duration(e.response.headers.get("retry-after")) or 1.0
+                raise RateLimitExceeded(bucket_model, retry_after)
+            continue
+        record_rate_limit_headers(bucket_model, raw.headers)
+        return raw.parse()
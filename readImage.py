@@ -1,13 +1,20 @@
 import json
 import base64
 import os
+import time
 import boto3
 from botocore.exceptions import ClientError
 from decimal import Decimal
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor
+from openai import OpenAI, APITimeoutError
+from rateLimiter import limited_call, estimate_tokens, RateLimitExceeded, RequestTooLarge
+from idempotency import idempotent
+from responseBuilder import decode_body
+from circuitBreaker import start_request, CircuitOpenError, DeadlineExceeded, TIMEOUT_RETRY_AFTER
 
 # Initialize OpenAI client
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+# Retries are left to rateLimiter.limited_call so each attempt is budgeted and deadline-capped
+client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"), max_retries=0)
 
 IMAGE_TO_TEXT_PROMPT = """
 Analyze this image and provide a highly detailed breakdown of the room for reconstruction by builders. be very detailed about the room structure.
@@ -54,8 +61,23 @@ Ensure that the output response is structured, precise, and comprehensive, makin
 
 """
 
+BATCH_IMAGES_PROMPT = """
+The following photos all show the same room, taken from different angles. Use every photo together and produce ONE description of the room, following the structure below. Refer to walls consistently across photos and do not describe the same wall, door or window twice.
+""" + IMAGE_TO_TEXT_PROMPT
+
+MERGE_ANALYSES_PROMPT = """
+The following are separate analyses of photos of the same room, each taken from a different angle. Merge them into ONE description of the room for builders, keeping the same structure (walls, doors & entryways, windows, fixtures & built-in features). Reconcile overlapping walls, doors and windows so each is described once, and prefer the most specific measurements.
+"""
+
 dynamodb = boto3.resource('dynamodb')
 TABLE_NAME = "users"
+IMAGE_INPUT_TOKENS = 1105  # upper bound for a high-detail 1024x1024 image on gpt-4o
+ANALYSIS_MAX_TOKENS = 700
+
+# Batch mode: several photos of one room in a single request.
+MAX_BATCH_IMAGES = 6
+BATCH_WORKERS = 3  # bounded fan-out so a batch cannot burst the shared OpenAI budget
+COMBINED_MAX_TOKENS = 1500  # above this a single multi-image answer risks being cut off; fan out instead
 
 def check_email_image_credits(email):
     table = dynamodb.Table(TABLE_NAME)
@@ -81,9 +103,10 @@ def subtract_image_credit(email):
     try:
         response = table.update_item(
             Key={'email': email},
-            UpdateExpression="SET image = image - :dec",
+            UpdateExpression="SET image = image - :dec, #version = if_not_exists(#version, :zero) + :one",
             ConditionExpression="image > :zero",
-            ExpressionAttributeValues={":dec": 1, ":zero": 0},
+            ExpressionAttributeNames={"#version": "version"},
+            ExpressionAttributeValues={":dec": 1, ":zero": 0, ":one": 1},
             ReturnValues="UPDATED_NEW"
         )
         
@@ -98,12 +121,94 @@ def subtract_image_credit(email):
         else:
             return {"success": False, "message": "Error updating item", "error": str(e)}
 
+def analyze_images(base64_images, prompt, max_tokens=ANALYSIS_MAX_TOKENS):
+    """Sends one or more images to GPT-4o in a single vision call and returns the text."""
+    content = [{"type": "text", "text": prompt}]
+    content += [{"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image}"}} for image in base64_images]
+
+    response = limited_call(
+        "gpt-4o",
+        estimate_tokens(prompt, max_tokens) + IMAGE_INPUT_TOKENS * len(base64_images),
+        client.chat.completions.with_raw_response.create,
+        model="gpt-4o",
+        messages=[{"role": "user", "content": content}],
+        max_tokens=max_tokens,
+    )
+    return response.choices[0].message.content
+
+def combined_max_tokens(image_count):
+    """Output budget for one call describing the whole batch: extra room per additional angle."""
+    return ANALYSIS_MAX_TOKENS + 200 * (image_count - 1)
+
+def analyze_batch_combined(base64_images):
+    """
+    Packs every photo into one multi-image call; cheapest, since the prompt is only sent once.
+    A single call has no per-image latency, so only the batch latency is reported.
+    """
+    start = time.monotonic()
+    analysis = analyze_images(base64_images, BATCH_IMAGES_PROMPT, combined_max_tokens(len(base64_images)))
+    return analysis, {"batchLatencyMs": round((time.monotonic() - start) * 1000)}
+
+def analyze_batch_parallel(base64_images):
+    """Analyzes each photo concurrently on a bounded pool, then merges the results in one text call."""
+    batch_start = time.monotonic()
+
+    def analyze_one(indexed_image):
+        index, image = indexed_image
+        start = time.monotonic()
+        try:
+            result = {"index": index, "analysis": analyze_images([image], IMAGE_TO_TEXT_PROMPT)}
+        except (RateLimitExceeded, RequestTooLarge, CircuitOpenError, DeadlineExceeded):
+            raise
+        except Exception as e:
+            print(f"Error analyzing image {index}: {e}")
+            result = {"index": index, "error": str(e)}
+        result["latencyMs"] = round((time.monotonic() - start) * 1000)
+        return result
+
+    with ThreadPoolExecutor(max_workers=min(BATCH_WORKERS, len(base64_images))) as executor:
+        per_image = list(executor.map(analyze_one, enumerate(base64_images)))
+
+    analyses = [r for r in per_image if "analysis" in r]
+    if not analyses:
+        raise RuntimeError("Failed to analyze any of the images")
+
+    merge_input = "\n\n".join(f"Photo {r['index'] + 1}:\n{r['analysis']}" for r in analyses)
+    response = limited_call(
+        "gpt-4o",
+        estimate_tokens(MERGE_ANALYSES_PROMPT + merge_input, COMBINED_MAX_TOKENS),
+        client.chat.completions.with_raw_response.create,
+        model="gpt-4o",
+        messages=[{"role": "user", "content": f"{MERGE_ANALYSES_PROMPT}\n{merge_input}"}],
+        max_tokens=COMBINED_MAX_TOKENS,
+    )
+    for r in per_image:
+        r.pop("analysis", None)
+    return response.choices[0].message.content, {
+        "images": per_image,
+        "batchLatencyMs": round((time.monotonic() - batch_start) * 1000),
+    }
+
+def parse_batch(body):
+    """Returns the list of base64 images for a batch request, or None for a single raw image body."""
+    if not body.lstrip().startswith("{"):
+        return None
+    try:
+        payload = json.loads(body)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(payload, dict) or "images" not in payload:
+        return None
+    return payload
+
+@idempotent("readImage")
 def lambda_handler(event, context):
     print(event)
     print("-------")
     """AWS Lambda function to analyze a room image from API Gateway."""
+    start_request(context)
     # Parse the incoming request
-    body = event["body"]
+    body = decode_body(event)
     base64_image = body
     email = event.get("queryStringParameters", {}).get("email")
         
@@ -141,23 +246,41 @@ def lambda_handler(event, context):
             }
 
 
-        # Send the image to OpenAI for analysis
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": IMAGE_TO_TEXT_PROMPT},
-                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}},
-                    ],
+        batch = parse_batch(base64_image)
+        if batch is not None:
+            images = batch["images"]
+            mode = batch.get("mode", "auto")
+            valid_images = (
+                isinstance(images, list)
+                and 1 <= len(images) <= MAX_BATCH_IMAGES
+                and all(isinstance(image, str) and image.strip() for image in images)
+            )
+            if not valid_images or mode not in ("auto", "combined", "parallel"):
+                return {
+                    "statusCode": 400,
+                    "headers": {"Access-Control-Allow-Origin": "*"},
+                    "body": json.dumps({"error": f"'images' must be a list of 1 to {MAX_BATCH_IMAGES} base64 strings "
+                                                 "and 'mode' one of auto, combined or parallel"})
                 }
-            ],
-            max_tokens=700,
-        )
 
-        # Extract response content
-        analysis_result = response.choices[0].message.content
+            if mode == "auto":
+                mode = "combined" if combined_max_tokens(len(images)) <= COMBINED_MAX_TOKENS else "parallel"
+
+            if mode == "combined":
+                analysis_result, stats = analyze_batch_combined(images)
+            else:
+                analysis_result, stats = analyze_batch_parallel(images)
+
+            # One credit covers the whole batch
+            credit_result = subtract_image_credit(email)
+            return {
+                "statusCode": 200,
+                "headers": {"Access-Control-Allow-Origin": "*"},
+                "body": json.dumps({"analysis": analysis_result, "mode": mode, **stats})
+            }
+
+        # Send the image to OpenAI for analysis
+        analysis_result = analyze_images([base64_image], IMAGE_TO_TEXT_PROMPT)
         credit_result = subtract_image_credit(email)
         return {
             "statusCode": 200,
@@ -165,9 +288,38 @@ def lambda_handler(event, context):
             "body": json.dumps({"analysis": analysis_result})
         }
 
+    except RequestTooLarge as e:
+        return {
+            "statusCode": 413,
+            "headers": {"Access-Control-Allow-Origin": "*"},
+            "body": json.dumps({"error": "Request is too large to process"})
+        }
+
+    except RateLimitExceeded as e:
+        return {
+            "statusCode": 429,
+            "headers": {"Access-Control-Allow-Origin": "*", "Retry-After": str(max(1, round(e.retry_after)))},
+            "body": json.dumps({"error": "Service busy, please retry shortly"})
+        }
+
+    except (CircuitOpenError, DeadlineExceeded) as e:
+        return {
+            "statusCode": 503,
+            "headers": {"Access-Control-Allow-Origin": "*", "Retry-After": str(max(1, round(getattr(e, "retry_after", 1))))},
+            "body": json.dumps({"error": "Service temporarily unavailable, please retry shortly"})
+        }
+
+    except APITimeoutError as e:
+        return {
+            "statusCode": 504,
+            "headers": {"Access-Control-Allow-Origin": "*", "Retry-After": str(TIMEOUT_RETRY_AFTER)},
+            "body": json.dumps({"error": "Upstream timed out, please retry shortly"})
+        }
+
     except Exception as e:
+        print(f"Image analysis failed: {e}")
         return {
             "statusCode": 500,
             "headers": {"Access-Control-Allow-Origin": "*"},
-            "body": json.dumps({"error": str(e)})
+            "body": json.dumps({"error": "Internal server error"})
         }
\ No newline at end of file
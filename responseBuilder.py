@@ -0,0 +1,131 @@
+import json
+import os
+import gzip
+import time
+import base64
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+# Builds API Gateway proxy responses, compressing large bodies when the client's
+# Accept-Encoding allows it. Compressed bodies are returned base64 encoded with
+# isBase64Encoded, which needs binary media types enabled on the API
+# (x-amazon-apigateway-binary-media-types in APIGatewayOpenAPI3.json). With those
+# enabled API Gateway also base64-encodes request bodies, so handlers read them
+# through decode_body.
+MIN_COMPRESS_BYTES = int(os.environ.get("COMPRESSION_MIN_BYTES", "1024"))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+DEFAULT_HEADERS = {
+    "Content-Type": "application/json",
+    "Access-Control-Allow-Origin": "*",
+}
+
+
+def decode_body(event):
+    """Return the request body as text, undoing API Gateway's base64 encoding of binary media types."""
+    body = (event or {}).get("body")
+    if body and event.get("isBase64Encoded"):
+        return base64.b64decode(body).decode("utf-8")
+    return body
+
+
+def _accepted_encodings(event):
+    """Parse Accept-Encoding into the set of codings the client will take (q > 0)."""
+    headers = {k.lower(): v for k, v in ((event or {}).get("headers") or {}).items()}
+    accepted = set()
+    for part in headers.get("accept-encoding", "").split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if coding and q > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def choose_encoding(event):
+    accepted = _accepted_encodings(event)
+    if brotli and ("br" in accepted or "*" in accepted):
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+def compress(body_bytes, encoding):
+    if encoding == "br":
+        return brotli.compress(body_bytes, quality=BROTLI_QUALITY)
+    return gzip.compress(body_bytes, compresslevel=GZIP_LEVEL)
+
+
+def decompress(data, encoding):
+    if encoding == "br":
+        return brotli.decompress(data)
+    return gzip.decompress(data)
+
+
+def _emit_metric(encoding, original_bytes, compressed_bytes, cpu_ms, cache_hit):
+    """Publish bytes saved and compression CPU time as a CloudWatch embedded metric."""
+    print(json.dumps({
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": "medicalSuite/Responses",
+                "Dimensions": [["encoding"]],
+                "Metrics": [
+                    {"Name": "CompressionBytesSaved", "Unit": "Bytes"},
+                    {"Name": "CompressionCpuTime", "Unit": "Milliseconds"},
+                    {"Name": "CompressionCacheHit", "Unit": "Count"},
+                ],
+            }],
+        },
+        "encoding": encoding,
+        "CompressionBytesSaved": original_bytes - compressed_bytes,
+        "CompressionCpuTime": round(cpu_ms, 3),
+        "CompressionCacheHit": 1 if cache_hit else 0,
+    }))
+
+
+def build_response(event, status_code, payload, headers=None, encoded_cache=None):
+    """
+    Return a Lambda proxy response for `payload` (a JSON-serializable object or an
+    already serialized string). Bodies above MIN_COMPRESS_BYTES are compressed with
+    the best encoding the client accepts. Pass a dict as `encoded_cache` to keep the
+    compressed bytes next to a cached payload so warm hits skip recompression.
+    """
+    body = payload if isinstance(payload, str) else json.dumps(payload)
+    response_headers = {**DEFAULT_HEADERS, **(headers or {}), "Vary": "Accept-Encoding"}
+
+    body_bytes = body.encode("utf-8")
+    encoding = choose_encoding(event)
+    if encoding is None or len(body_bytes) < MIN_COMPRESS_BYTES:
+        return {"statusCode": status_code, "headers": response_headers, "body": body}
+
+    cached = encoded_cache.get(encoding) if encoded_cache is not None else None
+    if cached is not None:
+        encoded_body, compressed_size = cached
+        _emit_metric(encoding, len(body_bytes), compressed_size, 0.0, cache_hit=True)
+    else:
+        cpu_start = time.process_time()
+        compressed = compress(body_bytes, encoding)
+        encoded_body = base64.b64encode(compressed).decode("ascii")
+        cpu_ms = (time.process_time() - cpu_start) * 1000
+        compressed_size = len(compressed)
+        if encoded_cache is not None:
+            encoded_cache[encoding] = (encoded_body, compressed_size)
+        _emit_metric(encoding, len(body_bytes), compressed_size, cpu_ms, cache_hit=False)
+
+    response_headers["Content-Encoding"] = encoding
+    return {
+        "statusCode": status_code,
+        "headers": response_headers,
+        "body": encoded_body,
+        "isBase64Encoded": True,
+    }
@@ -0,0 +1,85 @@
+import os
+import sys
+import time
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, TESTS_DIR)
+
+from fake_dynamodb import FakeDynamoDB  # noqa: E402
+from fake_upstream import FakeUpstream  # noqa: E402
+
+# The handlers build their boto3 and OpenAI clients at import time, so the fake
+# upstream has to be listening and the environment set before any of them load.
+UPSTREAM = FakeUpstream()
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+os.environ["OPENAI_API_KEY"] = "test-key"
+os.environ["OPENAI_BASE_URL"] = f"{UPSTREAM.url}/v1"
+
+import circuitBreaker  # noqa: E402
+import createImages  # noqa: E402
+import getQuote  # noqa: E402
+import getQuotes  # noqa: E402
+import getUserDetails  # noqa: E402
+import idempotency  # noqa: E402
+import marketingPlan  # noqa: E402
+import places  # noqa: E402
+import rateLimiter  # noqa: E402
+import readImage  # noqa: E402
+
+DYNAMODB_MODULES = [rateLimiter, idempotency, readImage, marketingPlan, places, getQuote, getUserDetails, getQuotes]
+
+
+class FakeContext:
+    """Lambda context whose remaining time counts down from `remaining_ms`."""
+
+    def __init__(self, remaining_ms=30000):
+        self._remaining_ms = remaining_ms
+        self._start = time.monotonic()
+
+    def get_remaining_time_in_millis(self):
+        return int(self._remaining_ms - (time.monotonic() - self._start) * 1000)
+
+
+@pytest.fixture
+def lambda_context():
+    return FakeContext
+
+
+@pytest.fixture
+def upstream():
+    UPSTREAM.reset()
+    yield UPSTREAM
+    UPSTREAM.reset()
+
+
+@pytest.fixture(autouse=True)
+def dynamo(monkeypatch):
+    """Point every handler at a fresh in-memory DynamoDB and reset warm-container state."""
+    fake = FakeDynamoDB()
+    for module in DYNAMODB_MODULES:
+        monkeypatch.setattr(module, "dynamodb", fake)
+    monkeypatch.setattr(getUserDetails, "table", fake.Table("users"))
+    monkeypatch.setattr(getQuotes, "table", fake.Table("quotes"))
+    monkeypatch.setattr(rateLimiter, "_local_buckets", {})
+    monkeypatch.setattr(rateLimiter, "_dynamo_disabled_until", 0.0)
+    monkeypatch.setattr(circuitBreaker, "_breakers", {})
+    monkeypatch.setattr(circuitBreaker, "_deadline", None)
+    monkeypatch.setattr(marketingPlan, "_section_client", None)
+    monkeypatch.setattr(getQuotes, "_catalog_cache", {"items": None, "expiresAt": 0, "encoded": {}})
+    monkeypatch.setattr(getUserDetails, "_user_cache", {})
+    return fake
+
+
+@pytest.fixture
+def make_user(dynamo):
+    def make(email="builder@example.com", **credits):
+        item = {"email": email, "image": 5, "marketing": 5, "doctor": 5, "quote": 5}
+        item.update(credits)
+        dynamo.Table("users").put_item(Item=item)
+        return email
+    return make
@@ -0,0 +1,247 @@
+"""
+In-memory stand-in for the boto3 DynamoDB resource, covering the calls the
+handlers make. Condition, update and projection expressions are actually
+evaluated, so conditional writes race and fail the way they do against DynamoDB.
+"""
+import re
+import threading
+import time
+from decimal import Decimal
+
+from botocore.exceptions import ClientError
+
+TABLE_KEYS = {
+    "users": "email",
+    "quotes": "compNameOfferering",
+    "rateLimits": "bucket",
+    "idempotency": "idempotencyKey",
+}
+
+_TOKEN = re.compile(r"\s*(<=|>=|<>|[=<>(),+\-]|[#:]?[A-Za-z_][A-Za-z0-9_]*)")
+
+
+def _tokenize(expression):
+    tokens, pos = [], 0
+    expression = expression.strip()
+    while pos < len(expression):
+        match = _TOKEN.match(expression, pos)
+        if not match:
+            raise ValueError(f"Cannot parse expression near: {expression[pos:]}")
+        tokens.append(match.group(1))
+        pos = match.end()
+    return tokens
+
+
+def _normalize(value):
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return Decimal(str(value))
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    return value
+
+
+class _Parser:
+    def __init__(self, expression, names, values, item):
+        self.tokens = _tokenize(expression)
+        self.pos = 0
+        self.names = names or {}
+        self.values = {k: _normalize(v) for k, v in (values or {}).items()}
+        self.item = item
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def take(self, expected=None):
+        token = self.peek()
+        if expected is not None and (token is None or token.upper() != expected.upper()):
+            raise ValueError(f"Expected {expected}, got {token}")
+        self.pos += 1
+        return token
+
+    def path(self):
+        token = self.take()
+        return self.names[token] if token.startswith("#") else token
+
+    def operand(self):
+        token = self.peek()
+        if token.startswith(":"):
+            self.take()
+            return self.values[token]
+        if token == "if_not_exists":
+            self.take()
+            self.take("(")
+            name = self.path()
+            self.take(",")
+            default = self.operand()
+            self.take(")")
+            return self.item.get(name, default) if self.item else default
+        name = self.path()
+        return self.item.get(name) if self.item else None
+
+    # Conditions
+    def condition(self):
+        result = self.conjunction()
+        while self.peek() and self.peek().upper() == "OR":
+            self.take()
+            rhs = self.conjunction()
+            result = result or rhs
+        return result
+
+    def conjunction(self):
+        result = self.negation()
+        while self.peek() and self.peek().upper() == "AND":
+            self.take()
+            rhs = self.negation()
+            result = result and rhs
+        return result
+
+    def negation(self):
+        if self.peek() and self.peek().upper() == "NOT":
+            self.take()
+            return not self.negation()
+        return self.comparison()
+
+    def comparison(self):
+        token = self.peek()
+        if token == "(":
+            self.take()
+            result = self.condition()
+            self.take(")")
+            return result
+        if token in ("attribute_exists", "attribute_not_exists"):
+            self.take()
+            self.take("(")
+            name = self.path()
+            self.take(")")
+            exists = self.item is not None and name in self.item
+            return exists if token == "attribute_exists" else not exists
+        lhs = self.operand()
+        op = self.take()
+        rhs = self.operand()
+        if lhs is None or rhs is None:
+            return op == "<>" and lhs != rhs
+        return {
+            "=": lhs == rhs, "<>": lhs != rhs, "<": lhs < rhs,
+            "<=": lhs <= rhs, ">": lhs > rhs, ">=": lhs >= rhs,
+        }[op]
+
+    # Updates
+    def updates(self):
+        self.take("SET")
+        assignments = []
+        while True:
+            name = self.path()
+            self.take("=")
+            value = self.operand()
+            if self.peek() in ("+", "-"):
+                op = self.take()
+                rhs = self.operand()
+                value = value + rhs if op == "+" else value - rhs
+            assignments.append((name, value))
+            if self.peek() != ",":
+                return assignments
+            self.take(",")
+
+    def projection(self):
+        names = [self.path()]
+        while self.peek() == ",":
+            self.take()
+            names.append(self.path())
+        return names
+
+
+def _conditional_failure(operation):
+    return ClientError(
+        {"Error": {"Code": "ConditionalCheckFailedException", "Message": "The conditional request failed"}},
+        operation,
+    )
+
+
+class FakeTable:
+    def __init__(self, name, latency=0.0):
+        self.name = name
+        self.key = TABLE_KEYS.get(name, "id")
+        self.items = {}
+        self.latency = latency
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def _check(self, operation, item, ConditionExpression=None, ExpressionAttributeNames=None,
+               ExpressionAttributeValues=None):
+        if ConditionExpression is None:
+            return
+        parser = _Parser(ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues, item)
+        if not parser.condition():
+            raise _conditional_failure(operation)
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_item(self, Key, ProjectionExpression=None, ExpressionAttributeNames=None, ConsistentRead=False):
+        self._wait()
+        with self._lock:
+            self.calls.append(("get_item", ProjectionExpression))
+            item = self.items.get(Key[self.key])
+            if item is None:
+                return {}
+            item = dict(item)
+        if ProjectionExpression:
+            wanted = _Parser(ProjectionExpression, ExpressionAttributeNames, None, None).projection()
+            item = {k: v for k, v in item.items() if k in wanted}
+        return {"Item": item}
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None,
+                 ExpressionAttributeValues=None):
+        self._wait()
+        with self._lock:
+            self.calls.append(("put_item", ConditionExpression))
+            current = self.items.get(Item[self.key])
+            self._check("PutItem", current, ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+            self.items[Item[self.key]] = _normalize(dict(Item))
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues=None):
+        self._wait()
+        with self._lock:
+            self.calls.append(("update_item", UpdateExpression))
+            current = self.items.get(Key[self.key])
+            self._check("UpdateItem", current, ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+            item = dict(current) if current else dict(_normalize(Key))
+            assignments = _Parser(UpdateExpression, ExpressionAttributeNames, ExpressionAttributeValues, item).updates()
+            for name, value in assignments:
+                item[name] = value
+            self.items[Key[self.key]] = item
+        if ReturnValues == "UPDATED_NEW":
+            return {"Attributes": {name: item[name] for name, _ in assignments}}
+        return {}
+
+    def delete_item(self, Key):
+        self._wait()
+        with self._lock:
+            self.calls.append(("delete_item", None))
+            self.items.pop(Key[self.key], None)
+        return {}
+
+    def scan(self):
+        self._wait()
+        with self._lock:
+            self.calls.append(("scan", None))
+            return {"Items": [dict(item) for item in self.items.values()]}
+
+
+class FakeDynamoDB:
+    """Drop-in for `boto3.resource('dynamodb')`; tables persist per name."""
+
+    def __init__(self):
+        self.tables = {}
+
+    def Table(self, name):
+        if name not in self.tables:
+            self.tables[name] = FakeTable(name)
+        return self.tables[name]
@@ -0,0 +1,88 @@
+"""
+Local HTTP stand-in for OpenAI, Flux and Google Places. Each test installs a
+`respond(path, payload)` callable returning `(status, headers, body)` and can
+sleep inside it to inject latency, hangs or errors. Requests are recorded.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def chat_completion(content, finish_reason="stop"):
+    return {
+        "id": "chatcmpl-test",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": "gpt-4o",
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": finish_reason,
+        }],
+        "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+    }
+
+
+def image_generation(url):
+    return {"created": int(time.time()), "data": [{"url": url}]}
+
+
+def default_respond(path, payload):
+    if path.endswith("/chat/completions"):
+        return 200, {}, chat_completion("fake analysis")
+    if path.endswith("/images/generations"):
+        return 200, {}, image_generation("http://example.invalid/image.png")
+    return 404, {}, {"error": {"message": f"no fake for {path}"}}
+
+
+class FakeUpstream:
+    def __init__(self):
+        self.respond = default_respond
+        self.requests = []
+        self._lock = threading.Lock()
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _handle(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                payload = json.loads(raw) if raw else None
+                with upstream._lock:
+                    upstream.requests.append((self.command, self.path, payload))
+                status, headers, body = upstream.respond(self.path, payload)
+                data = json.dumps(body).encode("utf-8")
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    for name, value in headers.items():
+                        self.send_header(name, value)
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            do_GET = _handle
+            do_POST = _handle
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        # Clients abandoning requests (cancelled sections, deadline timeouts) is expected
+        self.server.handle_error = lambda request, client_address: None
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def reset(self):
+        self.respond = default_respond
+        with self._lock:
+            self.requests = []
+
+    def paths(self):
+        with self._lock:
+            return [path for _, path, _ in self.requests]
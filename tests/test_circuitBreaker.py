@@ -0,0 +1,143 @@
+import json
+import time
+
+import pytest
+
+import circuitBreaker
+import places
+import readImage
+from fake_upstream import chat_completion
+
+
+@pytest.fixture
+def places_upstream(upstream, monkeypatch):
+    monkeypatch.setattr(places, "PLACES_API_BASE_URL", f"{upstream.url}/v1")
+    return upstream
+
+
+def search_event(email, radius=5000):
+    body = {"action": "nearbySearch", "params": {"location": {"lat": -26.2, "lng": 28.0}, "radius": radius}}
+    return {"queryStringParameters": {"email": email}, "body": json.dumps(body)}
+
+
+def failing(status):
+    return lambda path, payload: (status, {}, {"error": {"message": "injected"}})
+
+
+def test_breaker_opens_fails_fast_and_closes_after_probe(places_upstream, make_user, monkeypatch):
+    email = make_user(doctor=100)
+    places_upstream.respond = failing(500)
+
+    for i in range(circuitBreaker.FAILURE_THRESHOLD):
+        assert places.lambda_handler(search_event(email, radius=i), None)["statusCode"] == 500
+    assert circuitBreaker._breakers["places"]["state"] == circuitBreaker.OPEN
+
+    sent = len(places_upstream.requests)
+    response = places.lambda_handler(search_event(email, radius=99), None)
+    assert response["statusCode"] == 503
+    assert int(response["headers"]["Retry-After"]) >= 1
+    assert len(places_upstream.requests) == sent
+
+    monkeypatch.setattr(circuitBreaker, "RESET_TIMEOUT", 0.0)
+    places_upstream.respond = lambda path, payload: (200, {}, {"places": []})
+    assert places.lambda_handler(search_event(email, radius=100), None)["statusCode"] == 200
+    assert circuitBreaker._breakers["places"]["state"] == circuitBreaker.CLOSED
+
+
+def test_client_errors_do_not_trip_the_breaker(places_upstream, make_user):
+    email = make_user(doctor=100)
+    places_upstream.respond = failing(400)
+
+    for i in range(circuitBreaker.FAILURE_THRESHOLD + 1):
+        places.lambda_handler(search_event(email, radius=i), None)
+
+    assert circuitBreaker._breakers["places"]["state"] == circuitBreaker.CLOSED
+    assert len(places_upstream.requests) == circuitBreaker.FAILURE_THRESHOLD + 1
+
+
+def test_hanging_upstream_is_cut_off_at_the_deadline(places_upstream, make_user, lambda_context):
+    def hang(path, payload):
+        time.sleep(5)
+        return 200, {}, {"places": []}
+
+    places_upstream.respond = hang
+    started = time.monotonic()
+    # 2.5s left minus the 1.5s reserve leaves about a second for the call
+    response = places.lambda_handler(search_event(make_user()), lambda_context(2500))
+
+    assert response["statusCode"] == 504
+    assert int(response["headers"]["Retry-After"]) >= 1
+    assert time.monotonic() - started < 2.0
+
+
+def test_short_deadline_capped_timeouts_do_not_count_against_the_upstream(places_upstream, make_user, lambda_context):
+    email = make_user(doctor=100)
+
+    def hang(path, payload):
+        time.sleep(2)
+        return 200, {}, {"places": []}
+
+    places_upstream.respond = hang
+    # About 0.2s is left for each call, well under MIN_FAULT_TIMEOUT
+    for i in range(circuitBreaker.FAILURE_THRESHOLD + 1):
+        places.lambda_handler(search_event(email, radius=i), lambda_context(1700))
+
+    assert circuitBreaker._breakers["places"]["state"] == circuitBreaker.CLOSED
+    assert circuitBreaker._breakers["places"]["failures"] == 0
+
+
+def test_hung_upstream_opens_the_circuit(upstream, make_user, lambda_context, monkeypatch):
+    monkeypatch.setattr(circuitBreaker, "FAILURE_THRESHOLD", 3)
+    monkeypatch.setattr(circuitBreaker, "MIN_FAULT_TIMEOUT", 0.5)
+    email = make_user(image=100)
+
+    def hang(path, payload):
+        time.sleep(3)
+        return 200, {}, chat_completion("too late")
+
+    upstream.respond = hang
+    # Each call gets about a second, the deadline-capped budget, and times out
+    for i in range(3):
+        event = {"queryStringParameters": {"email": email}, "body": f"aW1hZ2U{i}"}
+        response = readImage.lambda_handler(event, lambda_context(2500))
+        assert response["statusCode"] == 504
+        assert int(response["headers"]["Retry-After"]) >= 1
+    assert circuitBreaker._breakers["openai"]["state"] == circuitBreaker.OPEN
+
+    sent = len(upstream.requests)
+    response = readImage.lambda_handler({"queryStringParameters": {"email": email}, "body": "bGF0ZXI="},
+                                        lambda_context(2500))
+    assert response["statusCode"] == 503
+    assert len(upstream.requests) == sent
+
+
+def test_spent_deadline_fails_without_calling_or_tripping(places_upstream, make_user, lambda_context):
+    response = places.lambda_handler(search_event(make_user()), lambda_context(1000))
+
+    assert response["statusCode"] == 503
+    assert places_upstream.requests == []
+    assert "places" not in circuitBreaker._breakers
+
+
+def test_openai_errors_are_not_retried_by_the_sdk(upstream, make_user):
+    upstream.respond = failing(500)
+
+    response = readImage.lambda_handler({"queryStringParameters": {"email": make_user()}, "body": "aGVsbG8="}, None)
+
+    assert response["statusCode"] == 500
+    assert json.loads(response["body"]) == {"error": "Internal server error"}
+    assert len(upstream.requests) == 1
+    assert circuitBreaker._breakers["openai"]["failures"] == 1
+
+
+def test_open_openai_breaker_returns_503(upstream, make_user):
+    email = make_user(image=100)
+    upstream.respond = failing(503)
+    for i in range(circuitBreaker.FAILURE_THRESHOLD):
+        readImage.lambda_handler({"queryStringParameters": {"email": email}, "body": f"aW1hZ2U{i}"}, None)
+
+    upstream.respond = lambda path, payload: (200, {}, chat_completion("recovered"))
+    response = readImage.lambda_handler({"queryStringParameters": {"email": email}, "body": "bGF0ZXI="}, None)
+
+    assert response["statusCode"] == 503
+    assert "Retry-After" in response["headers"]
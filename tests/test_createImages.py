@@ -0,0 +1,118 @@
+import random
+import statistics
+import threading
+import time
+
+import pytest
+
+import circuitBreaker
+import createImages
+
+
+@pytest.fixture
+def flux_upstream(upstream, monkeypatch):
+    monkeypatch.setattr(createImages, "API_URL", f"{upstream.url}/v1")
+    monkeypatch.setattr(createImages, "upload_to_s3", lambda url: f"s3://{url}")
+
+    def respond(path, payload):
+        if path.endswith("/flux-dev"):
+            return 200, {}, {"id": "flux-1"}
+        if "/get_result" in path:
+            return 200, {}, {"status": "Ready", "result": {"sample": "http://example.invalid/flux.png"}}
+        if path.endswith("/images/generations"):
+            return 200, {}, {"created": 0, "data": [{"url": "http://example.invalid/dalle.png"}]}
+        return 404, {}, {}
+
+    upstream.respond = respond
+    return upstream
+
+
+def test_both_providers_render_the_same_size(flux_upstream):
+    assert createImages.process_image("a kitchen") == "s3://http://example.invalid/flux.png"
+    assert createImages.process_image_OPEN_AI("a kitchen") == "s3://http://example.invalid/dalle.png"
+
+    flux_request = next(p for _, path, p in flux_upstream.requests if path.endswith("/flux-dev"))
+    dalle_request = next(p for _, path, p in flux_upstream.requests if path.endswith("/images/generations"))
+    assert (flux_request["width"], flux_request["height"]) == (1024, 1024)
+    assert dalle_request["size"] == "1024x1024"
+
+
+@pytest.mark.parametrize("providers", [[], ["openai", "flx"]])
+def test_misconfigured_providers_are_rejected(providers):
+    with pytest.raises(ValueError):
+        createImages.check_providers(providers)
+
+
+def test_abandoned_dalle_straggler_does_not_trip_the_breaker(upstream):
+    def slow_failure(path, payload):
+        time.sleep(0.3)
+        return 500, {}, {"error": {"message": "boom"}}
+
+    upstream.respond = slow_failure
+    cancelled = threading.Event()
+    threading.Timer(0.1, cancelled.set).start()
+
+    assert createImages.process_image_OPEN_AI("a kitchen", cancelled) is None
+    assert len(upstream.requests) == 1
+    assert circuitBreaker._breakers["openai"]["failures"] == 0
+
+
+def test_failed_provider_is_hedged_immediately(monkeypatch):
+    monkeypatch.setattr(createImages, "PROVIDERS", {
+        "openai": lambda prompt, cancelled=None: None,
+        "flux": lambda prompt, cancelled=None: "flux-url",
+    })
+
+    started = time.monotonic()
+    urls = createImages.generate_images_hedged("p", 4, ["openai", "flux"], hedge_delay=5)
+
+    assert urls == ["flux-url"] * 4
+    assert time.monotonic() - started < 1
+
+
+def skewed_provider(name, fast, slow, slow_ratio, seed):
+    """Fake provider: usually `fast` seconds, but `slow_ratio` of generations take `slow`."""
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    def generate(prompt, cancelled=None):
+        with lock:
+            delay = slow if rng.random() < slow_ratio else fast
+        deadline = time.monotonic() + delay
+        while time.monotonic() < deadline:
+            if cancelled is not None and cancelled.is_set():
+                return None
+            time.sleep(0.005)
+        return f"{name}-url"
+
+    return generate
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def test_hedging_cuts_tail_latency(monkeypatch):
+    """Benchmark: p95 of a 4-image request, DALL-E only vs hedged onto Flux."""
+    trials = 30
+
+    def run(providers):
+        monkeypatch.setattr(createImages, "PROVIDERS", {
+            "openai": skewed_provider("openai", fast=0.02, slow=0.3, slow_ratio=0.1, seed=7),
+            "flux": skewed_provider("flux", fast=0.05, slow=0.3, slow_ratio=0.02, seed=11),
+        })
+        latencies = []
+        for _ in range(trials):
+            started = time.monotonic()
+            urls = createImages.generate_images_hedged("p", 4, providers, hedge_delay=0.05)
+            latencies.append(time.monotonic() - started)
+            assert len(urls) == 4
+        return latencies
+
+    single = run(["openai"])
+    hedged = run(["openai", "flux"])
+
+    print(f"\nsingle provider: p50={statistics.median(single) * 1000:.0f}ms p95={percentile(single, 95) * 1000:.0f}ms")
+    print(f"hedged:          p50={statistics.median(hedged) * 1000:.0f}ms p95={percentile(hedged, 95) * 1000:.0f}ms")
+    assert percentile(hedged, 95) < percentile(single, 95) * 0.6
@@ -0,0 +1,131 @@
+import json
+import statistics
+import time
+
+import getQuote
+import getUserDetails
+import readImage
+
+HISTORY = [{"prompt": f"kitchen remodel {i}", "result": "tiles " * 20} for i in range(60)]
+
+
+def poll(email, fields=None, etag=None):
+    query = {"email": email}
+    if fields:
+        query["fields"] = fields
+    headers = {"If-None-Match": etag} if etag else {}
+    return getUserDetails.lambda_handler({"queryStringParameters": query, "headers": headers}, None)
+
+
+def projections(table):
+    return [projection for op, projection in table.calls if op == "get_item"]
+
+
+def test_fields_are_projected_and_version_is_not_leaked(dynamo, make_user):
+    email = make_user(history=HISTORY, version=3)
+
+    response = poll(email, fields="quote,image")
+
+    assert json.loads(response["body"]) == {"image": 5, "quote": 5}
+    assert projections(dynamo.Table("users")) == ["#f0, #f1, #f2"]
+
+
+def test_unchanged_record_gets_304(make_user):
+    email = make_user()
+    first = poll(email, fields="image")
+
+    second = poll(email, fields="image", etag=first["headers"]["ETag"])
+
+    assert second["statusCode"] == 304
+    assert second["body"] == ""
+
+
+def test_cached_record_is_revalidated_with_a_version_read(dynamo, make_user):
+    email = make_user(history=HISTORY)
+    poll(email, fields="image")
+
+    poll(email, fields="image")
+
+    assert projections(dynamo.Table("users"))[-1] == "#v"
+
+
+def test_debits_in_other_functions_invalidate_the_cached_record(dynamo, make_user):
+    email = make_user()
+    first = poll(email, fields="image,quote")
+
+    readImage.subtract_image_credit(email)
+    second = poll(email, fields="image,quote", etag=first["headers"]["ETag"])
+
+    assert second["statusCode"] == 200
+    assert json.loads(second["body"]) == {"image": 4, "quote": 5}
+    assert dynamo.Table("users").items[email]["version"] == 1
+
+
+def test_debit_of_an_unselected_field_keeps_the_etag(make_user):
+    email = make_user()
+    first = poll(email, fields="image")
+
+    getQuote.subtract_quote_credit(email)
+    second = poll(email, fields="image", etag=first["headers"]["ETag"])
+
+    assert second["statusCode"] == 304
+
+
+def test_writes_that_skip_the_version_show_up_after_the_ttl(dynamo, make_user, monkeypatch):
+    monkeypatch.setattr(getUserDetails, "USER_CACHE_TTL", 0.1)
+    email = make_user()
+    first = poll(email, fields="image")
+
+    dynamo.Table("users").items[email]["image"] = 50  # e.g. a top-up made outside these functions
+    time.sleep(0.2)
+    second = poll(email, fields="image", etag=first["headers"]["ETag"])
+
+    assert second["statusCode"] == 200
+    assert json.loads(second["body"]) == {"image": 50}
+
+
+def test_missing_user_is_404(make_user):
+    email = make_user()
+    poll(email, fields="image")
+    getUserDetails.table.items.pop(email)
+
+    assert poll(email, fields="image")["statusCode"] == 404
+
+
+def test_polling_with_projection_and_etag_is_cheaper(dynamo, make_user, monkeypatch):
+    """
+    Benchmark: the frontend polling credits every few seconds. Before, each poll read
+    and returned the full record; now it asks for the counters with If-None-Match and
+    is revalidated with a version read. Fake table latency grows with returned bytes.
+    """
+    email = make_user(history=HISTORY)
+    table = dynamo.Table("users")
+    get_item = table.get_item
+
+    def sized_get_item(**kwargs):
+        response = get_item(**kwargs)
+        size = len(json.dumps(getUserDetails.convert_decimals(response.get("Item", {}))))
+        time.sleep(0.002 + size / 1024 * 0.0005)
+        return response
+
+    monkeypatch.setattr(table, "get_item", sized_get_item)
+
+    def measure(fields, conditional):
+        samples, sent, etag = [], 0, None
+        for _ in range(20):
+            if not conditional:
+                getUserDetails._user_cache.clear()  # every poll is a full read, as before
+            started = time.monotonic()
+            response = poll(email, fields=fields, etag=etag if conditional else None)
+            samples.append(time.monotonic() - started)
+            sent += len(response["body"])
+            etag = response["headers"]["ETag"]
+        return statistics.median(samples), sent
+
+    before_p50, before_bytes = measure(None, conditional=False)
+    after_p50, after_bytes = measure("image,quote,marketing,doctor", conditional=True)
+
+    print(f"\nfull read p50={before_p50 * 1000:.1f}ms bytes={before_bytes} "
+          f"projected+304 p50={after_p50 * 1000:.1f}ms bytes={after_bytes}")
+    assert after_bytes < before_bytes / 100
+    assert after_p50 < before_p50
@@ -0,0 +1,181 @@
+import gzip
+import base64
+import json
+import threading
+import time
+
+import pytest
+
+import createImages
+import idempotency
+import readImage
+from responseBuilder import build_response
+
+
+def storm(handler, event, n, context=None):
+    """Fire `n` identical requests at once and return their responses."""
+    responses = [None] * n
+    barrier = threading.Barrier(n)
+
+    def run(i):
+        barrier.wait()
+        responses[i] = handler(event, context)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return responses
+
+
+def counting_handler(response=None, delay=0.2):
+    calls = []
+
+    @idempotency.idempotent("test")
+    def handler(event, context):
+        calls.append(1)
+        time.sleep(delay)
+        return response or {"statusCode": 200, "headers": {}, "body": "done"}
+
+    return handler, calls
+
+
+def test_duplicate_storm_runs_upstream_once(upstream, dynamo, make_user):
+    """Benchmark: 50 simultaneous retries of one paid readImage request."""
+    email = make_user()
+    event = {"queryStringParameters": {"email": email}, "body": "aGVsbG8="}
+
+    started = time.monotonic()
+    responses = storm(readImage.lambda_handler, event, 50)
+    elapsed = time.monotonic() - started
+
+    completions = [p for p in upstream.paths() if p.endswith("/chat/completions")]
+    replayed = sum(1 for r in responses if r["headers"].get("Idempotent-Replayed"))
+    print(f"\n50 duplicates: {len(completions)} upstream call, {replayed} replays, {elapsed * 1000:.0f}ms total")
+    assert len(completions) == 1
+    assert all(r["statusCode"] == 200 for r in responses)
+    assert replayed == 49
+    assert dynamo.Table("users").items[email]["image"] == 4
+
+
+def test_duplicate_of_long_running_request_gets_409(monkeypatch):
+    monkeypatch.setattr(idempotency, "WAIT_FOR_IN_PROGRESS", 0.1)
+    handler, calls = counting_handler(delay=0.6)
+    event = {"queryStringParameters": {"email": "a@example.com"}, "body": "x"}
+
+    responses = storm(handler, event, 2)
+
+    assert sorted(r["statusCode"] for r in responses) == [200, 409]
+    assert len(calls) == 1
+
+
+def test_lock_is_sized_from_remaining_time(dynamo, lambda_context):
+    handler, _ = counting_handler(delay=0)
+    event = {"queryStringParameters": {"email": "a@example.com"}, "body": "x"}
+    table = dynamo.Table("idempotency")
+    original_put = table.put_item
+    locks = []
+
+    def record(Item, **kwargs):
+        if Item["status"] == idempotency.IN_PROGRESS:
+            locks.append(Item["lockedUntil"] - int(time.time()))
+        return original_put(Item=Item, **kwargs)
+
+    table.put_item = record
+    handler(event, lambda_context(remaining_ms=3000))
+
+    assert locks and locks[0] <= 3 + idempotency.LOCK_SLACK + 1
+
+
+def test_retry_takes_over_after_owner_crashed(dynamo):
+    handler, calls = counting_handler(delay=0)
+    event = {"queryStringParameters": {"email": "a@example.com"}, "body": "x"}
+    key, _ = idempotency.idempotency_key(event, "test")
+    now = int(time.time())
+    # A marker left behind by an invocation that timed out a moment ago
+    dynamo.Table("idempotency").put_item(Item={
+        "idempotencyKey": key, "status": idempotency.IN_PROGRESS,
+        "lockedUntil": now - 1, "expiresAt": now + 300,
+    })
+
+    assert handler(event, None)["statusCode"] == 200
+    assert len(calls) == 1
+
+
+def test_failures_are_not_stored(dynamo):
+    handler, calls = counting_handler({"statusCode": 502, "headers": {}, "body": "nope"}, delay=0)
+    event = {"queryStringParameters": {"email": "a@example.com"}, "body": "x"}
+
+    handler(event, None)
+    handler(event, None)
+
+    assert len(calls) == 2
+    assert dynamo.Table("idempotency").items == {}
+
+
+def test_create_images_with_no_images_is_502_and_retryable(monkeypatch, dynamo):
+    monkeypatch.setattr(createImages, "generate_images_hedged", lambda prompt: [])
+    event = {"headers": {"Idempotency-Key": "k1"}, "body": "a kitchen"}
+
+    assert createImages.lambda_handler(event, None)["statusCode"] == 502
+    assert dynamo.Table("idempotency").items == {}
+
+
+def test_create_images_replay_never_outlives_presigned_urls(monkeypatch, dynamo):
+    monkeypatch.setattr(createImages, "generate_images_hedged", lambda prompt: ["https://signed"])
+    event = {"headers": {"Idempotency-Key": "k2"}, "body": "a kitchen"}
+
+    createImages.lambda_handler(event, None)
+
+    item = next(iter(dynamo.Table("idempotency").items.values()))
+    assert item["expiresAt"] - int(time.time()) <= createImages.EXPIRATION // 2
+
+
+def test_body_hash_without_email_is_not_shared_between_users():
+    handler, calls = counting_handler(delay=0)
+    event = {"body": "same prompt"}
+
+    handler(event, None)
+    handler(event, None)
+
+    assert len(calls) == 2
+
+
+def test_body_hash_keys_expire_quickly(dynamo):
+    handler, _ = counting_handler(delay=0)
+    handler({"queryStringParameters": {"email": "a@example.com"}, "body": "x"}, None)
+
+    item = next(iter(dynamo.Table("idempotency").items.values()))
+    assert item["expiresAt"] - int(time.time()) <= idempotency.HASH_KEY_TTL
+
+
+def test_replay_is_encoded_for_the_duplicate(dynamo):
+    payload = {"results": ["clinic"] * 500}
+    calls = []
+
+    @idempotency.idempotent("test")
+    def handler(event, context):
+        calls.append(1)
+        return build_response(event, 200, payload)
+
+    gzip_event = {"queryStringParameters": {"email": "a@example.com"}, "body": "x",
+                  "headers": {"Accept-Encoding": "gzip"}}
+    plain_event = {**gzip_event, "headers": {}}
+
+    first = handler(gzip_event, None)
+    replay_plain = handler(plain_event, None)
+    replay_gzip = handler(gzip_event, None)
+
+    assert len(calls) == 1
+    assert first["headers"]["Content-Encoding"] == "gzip"
+    assert "Content-Encoding" not in replay_plain["headers"]
+    assert json.loads(replay_plain["body"]) == payload
+    assert json.loads(gzip.decompress(base64.b64decode(replay_gzip["body"]))) == payload
+
+
+@pytest.mark.parametrize("headers", [{"Idempotency-Key": "abc"}, {"idempotency-key": "abc"}])
+def test_header_key_wins_over_body(headers):
+    key, ttl = idempotency.idempotency_key({"headers": headers, "body": "x"}, "s")
+    assert key.endswith("#abc")
+    assert ttl == idempotency.RESULT_TTL
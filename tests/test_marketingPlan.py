@@ -0,0 +1,156 @@
+import statistics
+import time
+
+import circuitBreaker
+import marketingPlan
+import rateLimiter
+from fake_upstream import chat_completion
+
+SECONDS_PER_TOKEN = 0.0003
+
+
+def token_paced(path, payload):
+    """Fake completion server whose latency grows with the requested output length."""
+    time.sleep(payload["max_tokens"] * SECONDS_PER_TOKEN)
+    content = payload["messages"][0]["content"]
+    title = content.split('"')[1] if content.startswith("You are writing one section") else "Plan"
+    return 200, {}, chat_completion(f"## {title}\nbody")
+
+
+def plan_event(email, mode, body="Plan for a mobile dog grooming van"):
+    return {"queryStringParameters": {"email": email, "mode": mode}, "body": body}
+
+
+def test_sections_are_assembled_in_order(upstream, make_user):
+    upstream.respond = token_paced
+
+    response = marketingPlan.lambda_handler(plan_event(make_user(), "sectioned"), None)
+
+    assert response["statusCode"] == 200
+    headings = [line for line in response["body"].splitlines() if line.startswith("## ")]
+    assert headings == [f"## {title}" for title, _, _ in marketingPlan.PLAN_SECTIONS]
+
+
+def test_failed_section_falls_back_without_waiting_for_the_rest(upstream, make_user, lambda_context):
+    def respond(path, payload):
+        content = payload["messages"][0]["content"]
+        if '"Budget"' in content:
+            return 500, {}, {"error": {"message": "boom"}}
+        if content.startswith("You are writing one section"):
+            time.sleep(1.5)
+            return 200, {}, chat_completion("late section")
+        return 200, {}, chat_completion("single-shot plan")
+
+    upstream.respond = respond
+    started = time.monotonic()
+    response = marketingPlan.lambda_handler(plan_event(make_user(), "sectioned"), lambda_context(30000))
+
+    assert response["body"] == "single-shot plan"
+    assert time.monotonic() - started < 1.0
+
+
+def test_sectioned_phase_leaves_room_for_fallback(upstream, make_user, lambda_context):
+    def respond(path, payload):
+        if payload["messages"][0]["content"].startswith("You are writing one section"):
+            time.sleep(10)
+        return 200, {}, chat_completion("single-shot plan")
+
+    upstream.respond = respond
+    started = time.monotonic()
+    # Sections only get half of the remaining time, so the fallback still fits
+    response = marketingPlan.lambda_handler(plan_event(make_user(), "sectioned"), lambda_context(5000))
+
+    assert response["statusCode"] == 200
+    assert response["body"] == "single-shot plan"
+    assert time.monotonic() - started < 3.5
+
+
+def test_sectioned_is_faster_than_single_shot(upstream, make_user):
+    """Benchmark: end-to-end latency of both paths against a token-paced fake server."""
+    upstream.respond = token_paced
+    email = make_user(marketing=100)
+
+    def measure(mode):
+        samples = []
+        for i in range(5):
+            started = time.monotonic()
+            response = marketingPlan.lambda_handler(plan_event(email, mode, body=f"{mode} plan {i}"), None)
+            samples.append(time.monotonic() - started)
+            assert response["statusCode"] == 200
+        return statistics.median(samples)
+
+    single = measure("single")
+    sectioned = measure("sectioned")
+
+    print(f"\nsingle-shot p50={single * 1000:.0f}ms sectioned p50={sectioned * 1000:.0f}ms")
+    assert sectioned < single * 0.8
+
+
+def test_abandoned_sections_do_not_trip_the_breaker(upstream, make_user, lambda_context):
+    def respond(path, payload):
+        if payload["messages"][0]["content"].startswith("You are writing one section"):
+            time.sleep(10)
+        return 200, {}, chat_completion("single-shot plan")
+
+    upstream.respond = respond
+    marketingPlan.lambda_handler(plan_event(make_user(), "sectioned"), lambda_context(6000))
+
+    assert circuitBreaker._breakers["openai"]["state"] == circuitBreaker.CLOSED
+    assert circuitBreaker._breakers["openai"]["failures"] == 0
+
+
+def test_section_client_is_reused_until_a_phase_is_aborted(upstream, make_user):
+    upstream.respond = token_paced
+    email = make_user(marketing=10)
+
+    marketingPlan.lambda_handler(plan_event(email, "sectioned", body="first"), None)
+    first = marketingPlan._section_client
+    marketingPlan.lambda_handler(plan_event(email, "sectioned", body="second"), None)
+
+    assert first is not None
+    assert marketingPlan._section_client is first
+
+    upstream.respond = lambda path, payload: (500, {}, {"error": {"message": "boom"}})
+    marketingPlan.lambda_handler(plan_event(email, "sectioned", body="third"), None)
+    assert marketingPlan._section_client is not first
+
+
+def test_abandoned_sections_stop_queueing_for_budget(upstream, dynamo, make_user, monkeypatch):
+    monkeypatch.setitem(rateLimiter.MODEL_LIMITS, "gpt-4o", {"rpm": 60, "tpm": 0})
+    dynamo.Table("rateLimits").put_item(Item={
+        "bucket": "gpt-4o", "requests": 0, "tokens": 0, "updatedAt": time.time(), "blockedUntil": 0})
+    grants = []
+    try_acquire = rateLimiter._try_acquire
+
+    def counting_try_acquire(model, tokens):
+        wait = try_acquire(model, tokens)
+        if wait <= 0:
+            grants.append(model)
+        return wait
+
+    monkeypatch.setattr(rateLimiter, "_try_acquire", counting_try_acquire)
+
+    def respond(path, payload):
+        if payload["messages"][0]["content"].startswith("You are writing one section"):
+            return 500, {}, {"error": {"message": "boom"}}
+        return 200, {}, chat_completion("single-shot plan")
+
+    upstream.respond = respond
+    response = marketingPlan.lambda_handler(plan_event(make_user(), "sectioned"), None)
+    time.sleep(2.5)  # queued sections would have woken up and taken more budget by now
+
+    assert response["body"] == "single-shot plan"
+    # The section that failed plus the fallback; the other five gave up their place in the queue
+    assert len(grants) == 2
+
+
+def test_openai_timeout_is_a_504_with_retry_after(upstream, make_user, lambda_context):
+    def hang(path, payload):
+        time.sleep(3)
+        return 200, {}, chat_completion("too late")
+
+    upstream.respond = hang
+    response = marketingPlan.lambda_handler(plan_event(make_user(), "single"), lambda_context(2500))
+
+    assert response["statusCode"] == 504
+    assert int(response["headers"]["Retry-After"]) >= 1
@@ -0,0 +1,135 @@
+import json
+
+import pytest
+from botocore.exceptions import ClientError
+
+import createImages
+import marketingPlan
+import rateLimiter
+import readImage
+from fake_upstream import chat_completion
+
+
+def marketing_event(email, body="Plan for a small plumbing business"):
+    return {"queryStringParameters": {"email": email}, "body": body}
+
+
+def completion_requests(upstream):
+    return [path for path in upstream.paths() if path.endswith("/chat/completions")]
+
+
+def test_marketing_plan_goes_through_limiter(upstream, dynamo, make_user):
+    email = make_user()
+    upstream.respond = lambda path, payload: (200, {"x-ratelimit-remaining-requests": "42"}, chat_completion("the plan"))
+
+    response = marketingPlan.lambda_handler(marketing_event(email), None)
+
+    assert response["statusCode"] == 200
+    assert response["body"] == "the plan"
+    assert dynamo.Table("users").items[email]["marketing"] == 4
+    bucket = dynamo.Table("rateLimits").items["gpt-4o"]
+    assert float(bucket["requests"]) <= 42
+
+
+def test_read_image_goes_through_limiter(upstream, make_user):
+    email = make_user()
+    event = {"queryStringParameters": {"email": email}, "body": "aGVsbG8="}
+
+    response = readImage.lambda_handler(event, None)
+
+    assert response["statusCode"] == 200
+    assert json.loads(response["body"]) == {"analysis": "fake analysis"}
+    sent = upstream.requests[-1][2]
+    assert sent["model"] == "gpt-4o"
+    assert sent["messages"][0]["content"][1]["image_url"]["url"].endswith("aGVsbG8=")
+
+
+def test_create_images_uses_dalle_through_limiter(upstream):
+    assert createImages.generate_image_OpenAI("a kitchen") == "http://example.invalid/image.png"
+    assert upstream.paths() == ["/v1/images/generations"]
+
+
+def test_upstream_429_is_retried_once_by_limiter_not_sdk(upstream, make_user):
+    email = make_user()
+    upstream.respond = lambda path, payload: (429, {"retry-after": "0"}, {"error": {"message": "slow down"}})
+
+    response = marketingPlan.lambda_handler(marketing_event(email), None)
+
+    assert response["statusCode"] == 429
+    assert int(response["headers"]["Retry-After"]) >= 1
+    # One attempt plus the limiter's single retry; the SDK itself must not retry.
+    assert len(completion_requests(upstream)) == 2
+
+
+def test_retry_after_blocks_shared_bucket(upstream, dynamo, make_user):
+    email = make_user()
+    calls = []
+
+    def respond(path, payload):
+        calls.append(path)
+        if len(calls) == 1:
+            return 429, {"retry-after": "1"}, {"error": {"message": "slow down"}}
+        return 200, {}, chat_completion("after waiting")
+
+    upstream.respond = respond
+    response = marketingPlan.lambda_handler(marketing_event(email), None)
+
+    assert response["statusCode"] == 200
+    assert response["body"] == "after waiting"
+    assert float(dynamo.Table("rateLimits").items["gpt-4o"]["blockedUntil"]) > 0
+
+
+def test_oversized_request_is_rejected_not_retried(upstream, make_user):
+    email = make_user()
+
+    response = marketingPlan.lambda_handler(marketing_event(email, body="x" * 120_000), None)
+
+    assert response["statusCode"] == 413
+    assert completion_requests(upstream) == []
+
+
+def test_exhausted_bucket_sheds_without_calling_upstream(upstream, monkeypatch, make_user):
+    email = make_user()
+    monkeypatch.setitem(rateLimiter.MODEL_LIMITS, "gpt-4o", {"rpm": 1, "tpm": 0})
+    monkeypatch.setattr(rateLimiter, "MAX_QUEUE_SECONDS", 0.5)
+
+    assert marketingPlan.lambda_handler(marketing_event(email, "first"), None)["statusCode"] == 200
+    response = marketingPlan.lambda_handler(marketing_event(email, "second"), None)
+
+    assert response["statusCode"] == 429
+    assert len(completion_requests(upstream)) == 1
+
+
+def test_headers_above_the_bucket_do_not_refill_it(upstream, monkeypatch, make_user):
+    email = make_user(marketing=10)
+    monkeypatch.setitem(rateLimiter.MODEL_LIMITS, "gpt-4o", {"rpm": 3, "tpm": 0})
+    monkeypatch.setattr(rateLimiter, "MAX_QUEUE_SECONDS", 0.5)
+    upstream.respond = lambda path, payload: (
+        200, {"x-ratelimit-remaining-requests": "4999"}, chat_completion("plan"))
+
+    statuses = [marketingPlan.lambda_handler(marketing_event(email, f"plan {i}"), None)["statusCode"]
+                for i in range(6)]
+
+    assert statuses == [200, 200, 200, 429, 429, 429]
+    assert float(rateLimiter.dynamodb.Table("rateLimits").items["gpt-4o"]["requests"]) < 1
+
+
+def test_headers_below_the_bucket_lower_it(dynamo):
+    rateLimiter.acquire("gpt-4o")
+
+    rateLimiter.record_rate_limit_headers("gpt-4o", {"x-ratelimit-remaining-requests": "2",
+                                                     "x-ratelimit-remaining-tokens": "100"})
+
+    bucket = dynamo.Table("rateLimits").items["gpt-4o"]
+    assert float(bucket["requests"]) == pytest.approx(2, abs=0.1)
+    assert float(bucket["tokens"]) == pytest.approx(100, abs=5)
+
+
+def test_falls_back_to_local_bucket_when_table_unavailable(monkeypatch, dynamo):
+    def broken(*args, **kwargs):
+        raise ClientError({"Error": {"Code": "ResourceNotFoundException", "Message": "no table"}}, "GetItem")
+
+    monkeypatch.setattr(dynamo.Table("rateLimits"), "get_item", broken)
+
+    assert rateLimiter.acquire("gpt-4o", 100) == pytest.approx(0, abs=0.1)
+    assert rateLimiter._local_buckets["gpt-4o"]["requests"] < rateLimiter.MODEL_LIMITS["gpt-4o"]["rpm"]
@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+import readImage
+from fake_upstream import chat_completion
+
+
+def batch_event(email, images, mode="auto"):
+    return {"queryStringParameters": {"email": email}, "body": json.dumps({"images": images, "mode": mode})}
+
+
+def test_combined_batch_is_one_call_with_batch_latency(upstream, dynamo, make_user):
+    email = make_user()
+
+    response = readImage.lambda_handler(batch_event(email, ["aaaa", "bbbb", "cccc"]), None)
+
+    body = json.loads(response["body"])
+    assert response["statusCode"] == 200
+    assert body["mode"] == "combined"
+    assert "batchLatencyMs" in body and "images" not in body
+    assert len(upstream.requests) == 1
+    assert len(upstream.requests[0][2]["messages"][0]["content"]) == 4
+    assert dynamo.Table("users").items[email]["image"] == 4
+
+
+def test_parallel_batch_reports_per_image_latency_and_debits_once(upstream, dynamo, make_user):
+    email = make_user()
+    upstream.respond = lambda path, payload: (200, {}, chat_completion("room"))
+
+    response = readImage.lambda_handler(batch_event(email, ["a1", "b2", "c3", "d4"], mode="parallel"), None)
+
+    body = json.loads(response["body"])
+    assert response["statusCode"] == 200
+    assert [image["index"] for image in body["images"]] == [0, 1, 2, 3]
+    assert all("latencyMs" in image for image in body["images"])
+    assert "batchLatencyMs" in body
+    # Four per-photo analyses plus one merge call
+    assert len(upstream.requests) == 5
+    assert dynamo.Table("users").items[email]["image"] == 4
+
+
+@pytest.mark.parametrize("images", [[], ["a"] * 7, [{"url": "x"}], [42], [""], "not-a-list"])
+def test_invalid_batches_are_rejected(upstream, make_user, images):
+    email = make_user()
+
+    response = readImage.lambda_handler(batch_event(email, images), None)
+
+    assert response["statusCode"] == 400
+    assert upstream.requests == []
+
+
+def test_unknown_mode_is_rejected(upstream, make_user):
+    response = readImage.lambda_handler(batch_event(make_user(), ["a"], mode="fast"), None)
+    assert response["statusCode"] == 400
@@ -0,0 +1,88 @@
+import base64
+import gzip
+import json
+
+import getQuotes
+import marketingPlan
+import readImage
+from responseBuilder import build_response, decode_body
+
+
+def gzip_event(**extra):
+    return {"headers": {"Accept-Encoding": "gzip, deflate, br;q=0"}, **extra}
+
+
+def decoded(response):
+    assert response["isBase64Encoded"] is True
+    return json.loads(gzip.decompress(base64.b64decode(response["body"])))
+
+
+def test_large_bodies_are_compressed_for_accepting_clients():
+    payload = [{"clinic": i} for i in range(300)]
+
+    response = build_response(gzip_event(), 200, payload)
+
+    assert response["headers"]["Content-Encoding"] == "gzip"
+    assert response["headers"]["Vary"] == "Accept-Encoding"
+    assert decoded(response) == payload
+
+
+def test_small_bodies_and_non_accepting_clients_stay_plain():
+    assert "isBase64Encoded" not in build_response(gzip_event(), 200, {"ok": True})
+    plain = build_response({"headers": {"Accept-Encoding": "gzip;q=0"}}, 200, [1] * 2000)
+    assert "Content-Encoding" not in plain["headers"]
+    assert plain["headers"]["Vary"] == "Accept-Encoding"
+
+
+def test_encoded_cache_skips_recompression():
+    cache = {}
+    payload = json.dumps(list(range(2000)))
+
+    first = build_response(gzip_event(), 200, payload, encoded_cache=cache)
+    second = build_response(gzip_event(), 200, payload, encoded_cache=cache)
+
+    assert "gzip" in cache
+    assert first["body"] == second["body"]
+
+
+def test_decode_body_handles_binary_media_types():
+    text = '{"action": "nearbySearch"}'
+    encoded = base64.b64encode(text.encode()).decode()
+
+    assert decode_body({"body": encoded, "isBase64Encoded": True}) == text
+    assert decode_body({"body": text, "isBase64Encoded": False}) == text
+    assert decode_body({"body": None}) is None
+
+
+def test_handlers_accept_base64_encoded_request_bodies(upstream, make_user):
+    email = make_user()
+    image = "aGVsbG8="
+    event = {
+        "queryStringParameters": {"email": email},
+        "body": base64.b64encode(image.encode()).decode(),
+        "isBase64Encoded": True,
+    }
+
+    assert readImage.lambda_handler(event, None)["statusCode"] == 200
+    assert upstream.requests[-1][2]["messages"][0]["content"][1]["image_url"]["url"].endswith(image)
+
+    prompt = "Plan for a bakery"
+    event["body"] = base64.b64encode(prompt.encode()).decode()
+    assert marketingPlan.lambda_handler(event, None)["statusCode"] == 200
+    assert upstream.requests[-1][2]["messages"][0]["content"] == prompt
+
+
+def test_get_quotes_serves_compressed_catalog_from_warm_cache(dynamo):
+    table = dynamo.Table("quotes")
+    for i in range(100):
+        table.put_item(Item={"compNameOfferering": f"company-{i}", "price": i, "description": "tiling " * 5})
+
+    first = getQuotes.lambda_handler(gzip_event(), None)
+    scans = len([c for c in table.calls if c[0] == "scan"])
+    second = getQuotes.lambda_handler(gzip_event(), None)
+
+    assert len(decoded(first)) == 100
+    assert second["body"] == first["body"]
+    assert getQuotes._catalog_cache["encoded"]
+    assert scans == 1
+    assert len([c for c in table.calls if c[0] == "scan"]) == scans